@@ -0,0 +1,161 @@
+"""This script audits all subfolders of the directory that was passed in as an argument in a single pass:
+subfolders without an ffp get one generated (see generate_ffp_checksums.py) and every existing ffp is verified (see check_all_ffp.py).
+The tree is walked once. A track read to generate a new ffp is not read again to verify it, see audit_items
+REM Sample cmd script
+REM the PYTHONIOENCODING=utf8 is to allow for unicode in filenames
+set PYTHONIOENCODING=utf8
+SET WORKPATH='%~dp0'
+C:/Users/mexic/AppData/Local/Programs/Python/Python312/python.exe l:/Flac/audit_library.py "%WORKPATH%" >> log.txt
+pause
+"""
+import os
+import argparse
+import logging
+import concurrent.futures
+from pathlib import Path
+from datetime import datetime
+from filefolder_org import remove_empty_file,load_config,fix_directory_name
+from losslessfiles import ffp,verifyscheduler,verifyflacfile,read_flac_fingerprint_deep,VerifyEngine
+from executorbackend import select_backend,make_executor
+from devicequeue import devicelimiter
+from verifycache import verifycache
+from resultsink import resultsink,progress
+from generate_ffp_checksums import generate_checksums_for_folder
+from check_all_ffp import prefetch,calibration_sample
+
+
+def audit_items(rootdirectory, generate, tier = 'full', engine = None, cache = None, generated = None, errors = None):
+    """
+    Walk rootdirectory once and generate the ffp files to verify, parsing each one as it is found.
+    Each direct subfolder without an ffp is passed to generate (which returns a future of the new ffp) while the walk continues.
+    A new ffp is only verified again when generating it did not already check its tracks:
+    generated with the native engine at the full tier the audio was decoded and checked against the STREAMINFO MD5, and at the fast tier the header read is the check.
+    Only with the flac engine at the full tier are the new ffps passed on to be tested by flac. generated collects the ffp objects that were written.
+    The errors of ffps that are not passed on (failed generation, or not verified again) are added to errors here, the scheduler reports the others.
+    The tracks of ffps generated from decoded audio are recorded in cache as passed.
+    A folder whose generation fails is printed, logged and added to errors, and the audit carries on with the other folders.
+    """
+    engine = engine if engine != None else VerifyEngine
+    decoded = tier == 'full' and engine == 'native'
+    reverify = tier == 'full' and engine == 'flac'
+    pending = []
+    generated = generated if generated != None else []
+    errors = errors if errors != None else []
+    logger = logging.getLogger(__name__)
+
+    def completed(wait = False):
+        """new ffps whose generation is done"""
+        done = [(dirnm, future) for (dirnm, future) in pending if wait or future.done()]
+        for (dirnm, future) in done:
+            pending.remove((dirnm, future))
+            try:
+                ffpfile = future.result()
+            except Exception as e:
+                Err = f"Error generating checksums for {dirnm}: {e}"
+                print(Err)
+                logger.error(Err)
+                errors.append(Err)
+                continue
+            if ffpfile is None:
+                continue
+            if ffpfile.errors or not ffpfile.signatures:
+                errors.extend(ffpfile.errors)
+                continue
+            generated.append(ffpfile)
+            if reverify:
+                yield ffpfile
+            elif cache is not None and decoded:
+                #decoded while generating, the next run does not need to decode them again
+                for (filenm,checksum) in ffpfile.signatures.items():
+                    cache.record(ffpfile.location + '/' + filenm, checksum, True, f"{filenm}:{checksum} passed (generated).")
+                cache.commit()
+
+    root = Path(rootdirectory).as_posix()
+    for path, directories, files in os.walk(rootdirectory):
+        ffpnames = [file for file in files if file.lower().endswith(".ffp")]
+        for file in ffpnames:
+            ffpfile = ffp(path,file,{})
+            ffpfile.readffpfile()
+            yield ffpfile
+        #each subfolder of the directory is an album, same as generate_ffp_checksums.py
+        if not ffpnames and Path(path).parent.as_posix() == root:
+            pending.append((path, generate(path)))
+        yield from completed()
+    yield from completed(wait = True)
+
+def main(rootdirectory, tier = 'full'):
+    errors = []
+    date = datetime.now().strftime('%Y%m%d%H%M%S') #date for the log name
+    logger = logging.getLogger(__name__)
+    logfilename = f'{rootdirectory}/Audit{date}.log'
+    logging.basicConfig(filename=logfilename, level=logging.ERROR ,format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%d-%b-%y %H:%M:%S') #create log file
+    config_file = os.path.join(os.path.dirname(__file__),"config.toml")
+    config = load_config(config_file)
+    PathToMetaflac = config['supportfiles']['metaflac']
+    verifyconfig = config.get('verify', {})
+    cache = None
+    if verifyconfig.get('cache'):
+        cache = verifycache(verifyconfig['cache'], verifyconfig.get('reverify_days', 30))
+    ffpcount = 0
+
+    def log_ffp_errors(ffpfile):
+        """called by the scheduler once all tracks of an ffp are verified"""
+        nonlocal ffpcount
+        ffpcount += 1
+        for error in ffpfile.errors:
+            print(error)
+            errors.append(error)
+            logger.error(error)
+
+    engine = verifyconfig.get('engine', VerifyEngine)
+    #new ffps are generated from decoded audio when the native engine would decode the tracks to verify them anyway
+    deep = tier == 'full' and engine == 'native'
+    backend, workers = select_backend(f'verify:{engine}', rootdirectory, verifyflacfile, lambda count: calibration_sample(rootdirectory, engine, count),
+                                      cpu_bound = lambda fn, args: args[-1] == 'native')
+    sink = None
+    summary = None
+    if verifyconfig.get('results'):
+        sink = resultsink(f'{rootdirectory}/Audit{date}.{verifyconfig["results"]}')
+        summary = progress(verifyconfig.get('progress_seconds', 10))
+    scheduler = verifyscheduler(max_workers = verifyconfig.get('workers') or workers, cache = cache, tier = tier, backend = backend,
+                                sink = sink, progress = summary, silent = sink is not None, keep_results = sink is None)
+    generated = []
+    #the header reads of new ffps share one pool, the folder threads only walk the folders and wait on their reads.
+    #the limiter keeps the reads on each device within [io] device_workers, as in generate_ffp_checksums.py
+    limiter = devicelimiter()
+    with make_executor(backend, workers, lambda fn, args: fn is read_flac_fingerprint_deep) as readers, \
+         concurrent.futures.ThreadPoolExecutor() as folders:
+        generate = lambda dirnm: folders.submit(generate_checksums_for_folder, dirnm, PathToMetaflac, readers, deep, False, limiter)
+        try:
+            scheduler.run(prefetch(audit_items(rootdirectory, generate, tier, engine, cache, generated, errors)), on_complete = log_ffp_errors)
+        finally:
+            if sink is not None:
+                sink.close()
+    if sink is not None:
+        summary.report()
+        print(f'Results written to {sink.path}')
+    print(f'{len(generated)} ffp files generated, {ffpcount} verified')
+    if len(errors) > 0:
+        print('Errors:')
+        for error in errors:
+            print(f'Error: {error}')
+    else:
+        print('No errors occurred')
+    if cache is not None:
+        cache.close()
+    #Close the log file and delete if it is empty
+    logging.shutdown()
+    remove_empty_file(logfilename)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate the missing ffp files and verify the existing ones in all subfolders of a directory, in one pass')
+    parser.add_argument('directory')
+    parser.add_argument('--fast', action='store_true', help='only compare the STREAMINFO MD5 with the ffp, fully decoding just the tracks in today\'s scrub slice')
+    args = parser.parse_args()
+    rd = str(args.directory)
+    while rd[-1:] in ["'"]:
+        rd = rd[:len(rd)-1]
+    while rd[0] in ["'"]:
+        rd = rd[1:]
+    rd = fix_directory_name(rd)
+    main(rd, tier = 'fast' if args.fast else 'full')
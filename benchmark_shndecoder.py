@@ -0,0 +1,74 @@
+"""This script compares decoding every .shn file in a directory with shorten -x (the shorten path in config.toml) and with shndecoder
+Both decoders are checked to produce the same bytes, compared by the MD5 of the whole output. Without shorten.exe only the native decoder is timed.
+Usage:
+python benchmark_shndecoder.py <directory>
+"""
+import os
+import sys
+import time
+import hashlib
+import subprocess
+from losslessfiles import PathToShorten, READ_BUFFER_SIZE
+from shndecoder import shndecoder
+
+
+def find_shn_files(DirectoryName):
+    filepaths = []
+    for path, directories, files in os.walk(DirectoryName):
+        for file in files:
+            if file.lower().endswith(".shn"):
+                filepaths.append(os.path.join(path, file))
+    return sorted(filepaths)
+
+def decode_native(filepath):
+    """MD5 and length of the shndecoder output"""
+    md5hash = hashlib.md5()
+    size = 0
+    for chunk in shndecoder(filepath).chunks():
+        md5hash.update(chunk)
+        size += len(chunk)
+    return md5hash.hexdigest(), size
+
+def decode_shorten(filepath, shorten_exe = None):
+    """MD5 and length of the shorten -x output"""
+    proc = subprocess.Popen([shorten_exe if shorten_exe else PathToShorten, '-x', filepath, '-'], stdout=subprocess.PIPE)
+    md5hash = hashlib.md5()
+    size = 0
+    while True:
+        chunk = proc.stdout.read(READ_BUFFER_SIZE)
+        if not chunk:
+            break
+        md5hash.update(chunk)
+        size += len(chunk)
+    proc.stdout.close()
+    if proc.wait() != 0:
+        raise Exception(f'shorten returned {proc.returncode} for {filepath}')
+    return md5hash.hexdigest(), size
+
+def time_method(name, fn, filepaths):
+    start = time.perf_counter()
+    results = [fn(filepath) for filepath in filepaths]
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    size = sum(size for (md5, size) in results)
+    #44.1kHz 16 bit stereo, which nearly all .shn files are
+    seconds = size / 176400
+    print(f'{name:<12} {len(filepaths)} files in {elapsed:.3f}s, {size / elapsed / 1048576:.1f} MiB/s of PCM, {seconds / elapsed:.1f}x realtime (CD audio)')
+    return results
+
+def main(DirectoryName):
+    filepaths = find_shn_files(DirectoryName)
+    if not filepaths:
+        print(f'No shn files found in {DirectoryName}')
+        return
+    native_results = time_method('shndecoder', decode_native, filepaths)
+    if not PathToShorten or not os.path.isfile(PathToShorten):
+        print(f'shorten not found at {PathToShorten}, skipping the comparison')
+        return
+    shorten_results = time_method('shorten -x', decode_shorten, filepaths)
+    mismatches = [filepath for filepath, a, b in zip(filepaths, native_results, shorten_results) if a != b]
+    for filepath in mismatches:
+        print(f'Mismatch: {filepath}')
+    print(f'{len(mismatches)} mismatches')
+
+if __name__ == "__main__":
+    main(sys.argv[1])
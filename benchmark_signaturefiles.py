@@ -0,0 +1,70 @@
+"""This script compares the previous ffp reader (open up to three times to guess the encoding, reverse and split every line) with signaturefiles on generated 100k line ffp, md5 and st5 files
+Both readers are checked to return the same signatures for the ffp file.
+Usage:
+python benchmark_signaturefiles.py [lines]
+"""
+import os
+import sys
+import time
+import tempfile
+from signaturefiles import read_signature_file
+
+
+def legacy_readffpfile(ffpName):
+    """the ffp reader before signaturefiles, kept here for comparison"""
+    ffp_sigs = {}
+    ffp = open(ffpName, encoding="utf-8")
+    try:
+        firstline = ffp.readline()
+        ffp.close()
+        ffp = open(ffpName, encoding="utf-8")
+    except UnicodeDecodeError:
+        ffp.close()
+        ffp = open(ffpName)
+    for line in ffp:
+            if not line.startswith(';') and ':' in line:
+                ffp_line = line.strip().replace('\\','/')
+                ffp_parts = ffp_line[::-1].split(':',1)
+                ffp_sigs[ffp_parts[1][::-1]] = ffp_parts[0][::-1]
+            else:
+                if not line.startswith(';') and '*' in line:
+                    ffp_line = line.strip().replace('\\','/')
+                    ffp_parts = ffp_line[::-1].split('*',1)
+                    ffp_sigs[ffp_parts[0][::-1].strip()] = ffp_parts[1][::-1].strip()
+    ffp.close()
+    return ffp_sigs
+
+def write_sample_files(folder, lines):
+    """write ffp, md5 and st5 files with the given number of lines, returns their paths"""
+    paths = {kind: os.path.join(folder, f'sample.{kind}') for kind in ('ffp', 'md5', 'st5')}
+    with open(paths['ffp'], 'w', encoding='utf-8') as ffp, open(paths['md5'], 'w', encoding='utf-8') as md5, open(paths['st5'], 'w', encoding='utf-8') as st5:
+        ffp.write('; generated by benchmark_signaturefiles.py\n')
+        for i in range(lines):
+            signature = f'{i:032x}'
+            track = f'disc{i // 1000:03d}/artist - track {i:06d} - título.flac'
+            ffp.write(f'{track}:{signature}\n')
+            md5.write(f'{signature} *{track}\n')
+            st5.write(f'{signature}  [shntool]  {track}\n')
+    return paths
+
+def time_reader(name, fn, path, repeat = 3):
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f'{name:<28} {len(result)} entries, best of {repeat}: {best * 1000:.1f} ms')
+    return result
+
+def main(lines = 100000):
+    with tempfile.TemporaryDirectory() as folder:
+        paths = write_sample_files(folder, lines)
+        legacy = time_reader('legacy readffpfile (ffp)', legacy_readffpfile, paths['ffp'])
+        unified = time_reader('signaturefiles (ffp)', read_signature_file, paths['ffp'])
+        time_reader('signaturefiles (md5)', read_signature_file, paths['md5'])
+        time_reader('signaturefiles (st5)', read_signature_file, paths['st5'])
+        print('ffp results match' if legacy == unified else 'ffp results DIFFER')
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,43 @@
+"""This script compares reading the STREAMINFO MD5 of every flac file in a directory with mutagen (the previous method) and with read_streaminfo
+Both methods are checked to return the same values. Run each method twice so the second pass is not dominated by cold disk reads.
+Usage:
+python benchmark_streaminfo.py <directory> [passes]
+"""
+import os
+import sys
+import time
+from mutagen.flac import FLAC
+from losslessfiles import read_streaminfo, streaminfo_from_mutagen
+
+
+def find_flac_files(DirectoryName):
+    filepaths = []
+    for path, directories, files in os.walk(DirectoryName):
+        for file in files:
+            if file.lower().endswith(".flac"):
+                filepaths.append(os.path.join(path, file))
+    return filepaths
+
+def time_method(name, fn, filepaths):
+    start = time.perf_counter()
+    results = [fn(filepath) for filepath in filepaths]
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f'{name:<16} {len(filepaths)} files in {elapsed:.3f}s, {len(filepaths) / elapsed:.0f} files/s, {elapsed / len(filepaths) * 1e6:.1f} us/file')
+    return results
+
+def main(DirectoryName, passes = 2):
+    filepaths = find_flac_files(DirectoryName)
+    if not filepaths:
+        print(f'No flac files found in {DirectoryName}')
+        return
+    for i in range(passes):
+        print(f'Pass {i + 1}:')
+        mutagen_results = time_method('mutagen', lambda filepath: streaminfo_from_mutagen(FLAC(filepath)), filepaths)
+        streaminfo_results = time_method('read_streaminfo', read_streaminfo, filepaths)
+    mismatches = [filepath for filepath, a, b in zip(filepaths, mutagen_results, streaminfo_results) if a != b]
+    for filepath in mismatches:
+        print(f'Mismatch: {filepath}')
+    print(f'{len(mismatches)} mismatches')
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 2)
@@ -8,31 +8,97 @@ pause
 """
 import os
 import subprocess
+import argparse
 import logging
-import sys
 import concurrent.futures
+import queue
+import threading
 from filefolder_org import remove_empty_file,load_config,fix_directory_name
 from datetime import datetime
-from losslessfiles import ffp
+from losslessfiles import ffp,md5,verifyscheduler,verifyflacfile,VerifyEngine
+from executorbackend import select_backend,calibration_size,ExecutorConfig
+from verifycache import verifycache
+from verifyjournal import verifyjournal
+from resultsink import resultsink,progress
 
 
 
 #use unicode instead of ascii, NOTE: Also need to add "set PYTHONIOENCODING=utf-8" if redirecting the output
 os.system('chcp 65001 > NUL 2>&1') #windows only?
 
-def build_ffp_file_list(DirectoryName):
-    """Generate the list of ffp files that are available to be verified"""
-    ffplist = []
+#number of parsed ffp files discovery may get ahead of verification
+DISCOVERY_QUEUE_SIZE = 64
+
+def iter_ffp_files(DirectoryName):
+    """Generate the ffp files that are available to be verified, parsing each one as it is found"""
     for path, directories, files in os.walk(DirectoryName):
         for file in files:
             smallfile = file.lower()
             if smallfile.endswith(".ffp"):
                 ffpfile = ffp(path,file,{})
                 ffpfile.readffpfile()
-                ffplist.append(ffpfile)
-    return ffplist
+                yield ffpfile
+
+def iter_verify_files(DirectoryName, md5files = False):
+    """Generate the ffp files to verify and, with md5files, the md5 files of folders that have no ffp, walking the tree once"""
+    for path, directories, files in os.walk(DirectoryName):
+        ffpnames = [file for file in files if file.lower().endswith(".ffp")]
+        for file in ffpnames:
+            ffpfile = ffp(path,file,{})
+            ffpfile.readffpfile()
+            yield ffpfile
+        if md5files and not ffpnames:
+            for file in files:
+                if file.lower().endswith(".md5"):
+                    md5file = md5(path,file,{})
+                    md5file.readmd5file()
+                    yield md5file
+
+def build_ffp_file_list(DirectoryName):
+    """Generate the list of ffp files that are available to be verified"""
+    return list(iter_ffp_files(DirectoryName))
+
+def calibration_sample(DirectoryName, engine, count = None):
+    """collect the first few tracks of the library as (size, device, verifyflacfile args) for calibrating the executor backend"""
+    count = count if count else (ExecutorConfig.get('calibration_files') or calibration_size())
+    sample = []
+    for ffpfile in iter_ffp_files(DirectoryName):
+        if ffpfile.errors:
+            continue
+        for (filenm,checksum) in ffpfile.signatures.items():
+            try:
+                st = os.stat(ffpfile.location + '/' + filenm)
+            except OSError:
+                continue
+            sample.append((st.st_size, st.st_dev, (filenm,checksum,ffpfile.flacpath,ffpfile.metaflacpath,ffpfile.name,ffpfile.location,engine)))
+            if len(sample) >= count:
+                return sample
+    return sample
 
-def main(rootdirectory):
+def prefetch(iterable, maxsize = DISCOVERY_QUEUE_SIZE):
+    """
+    Run iterable in a background thread, handing its items over through a bounded queue.
+    Discovery (walking the tree and parsing ffps) then overlaps with verification, and at most maxsize items are held in memory waiting to be verified.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    def produce():
+        try:
+            for item in iterable:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def main(rootdirectory, tier = 'full', resume = False, checkmd5 = False):
     errors = []
     date = datetime.now().strftime('%Y%m%d%H%M%S') #date for the log name
     logger = logging.getLogger(__name__)
@@ -43,19 +109,59 @@ def main(rootdirectory):
     config = load_config(config_file)
     PathToFlac = config['supportfiles']['flac']
     PathToMetaflac = config['supportfiles']['metaflac']
-    ffps = build_ffp_file_list(rootdirectory)
-    if (len(ffps)) == 0:
-        print(f'No fingerprints to verify in subdirectories of {rootdirectory}')
-    for ffpfile in ffps:
-        if not ffpfile.errors:
-            logger.info('Verifying: ' + ffpfile.name + ' in ' +ffpfile.location)
-            ffpfile.verify() #= verifyffp(ffpfile,PathToFlac,PathToMetaflac)
+    verifyconfig = config.get('verify', {})
+    cache = None
+    if verifyconfig.get('cache'):
+        #skip files that passed recently and have not changed since
+        cache = verifycache(verifyconfig['cache'], verifyconfig.get('reverify_days', 30))
+    #every completed track is journaled so an interrupted run can continue with --resume
+    journal = verifyjournal(f'{rootdirectory}/VerifyJournal.jsonl', resume = resume)
+    if resume and journal.entries:
+        print(f'Resuming, {len(journal.entries)} files were verified in an earlier session')
+    ffpcount = 0
+
+    def log_ffp_errors(ffpfile):
+        """called by the scheduler once all tracks of an ffp are verified"""
+        nonlocal ffpcount
+        ffpcount += 1
+        logger.info('Verified: ' + ffpfile.name + ' in ' +ffpfile.location)
         for error in ffpfile.errors:
             print(error)
             errors.append(error)
             logger.error(error)
-        #for result in ffpfile.result:
-        #    print(result)
+
+    #one pool for the whole library so the number of files being verified stays constant across album boundaries
+    #ffps are verified as they are discovered instead of walking the whole tree first
+    #the fast tier checks the headers only and fully decodes a rotating slice of the library, see [verify] scrub_days
+    #thread/process/hybrid backend, calibrated on the first run when [executor] backend = "auto"
+    engine = verifyconfig.get('engine', VerifyEngine)
+    backend, workers = select_backend(f'verify:{engine}', rootdirectory, verifyflacfile, lambda count: calibration_sample(rootdirectory, engine, count),
+                                      cpu_bound = lambda fn, args: args[-1] == 'native')
+    #machine readable results are written in batches by a background thread, the console then only shows a periodic summary and the errors
+    sink = None
+    summary = None
+    if verifyconfig.get('results'):
+        sink = resultsink(f'{rootdirectory}/Verify{date}.{verifyconfig["results"]}')
+        summary = progress(verifyconfig.get('progress_seconds', 10))
+    scheduler = verifyscheduler(max_workers = verifyconfig.get('workers') or workers, cache = cache, tier = tier, journal = journal, backend = backend,
+                                sink = sink, progress = summary, silent = sink is not None, keep_results = sink is None)
+    try:
+        #folders that only have an md5 file are checked by hashing the whole files, in the same pool as the ffps
+        scheduler.run(prefetch(iter_verify_files(rootdirectory, checkmd5)), on_complete = log_ffp_errors)
+    except BaseException:
+        journal.close()
+        if sink is not None:
+            sink.close()
+        print('Verification interrupted, run again with --resume to continue')
+        raise
+    #the run completed, the next one starts over
+    journal.close(remove = True)
+    if sink is not None:
+        sink.close()
+        summary.report()
+        print(f'Results written to {sink.path}')
+    if ffpcount == 0:
+        print(f'No fingerprints to verify in subdirectories of {rootdirectory}')
     if len(errors) > 0:
         log_err_sum = False
         if logger.getEffectiveLevel() < 40: #if we need to scroll through the log, summarize the errors at the end
@@ -68,6 +174,8 @@ def main(rootdirectory):
                 logger.error(error)
     else:
         print('No errors occurred')
+    if cache is not None:
+        cache.close()
     logger.info(f'Completed searching and verifying *.ffp files recursively in {rootdirectory}')
     #Close the log file and delete if it is empty
     logging.shutdown()
@@ -78,12 +186,18 @@ if __name__ == "__main__":
     #To do: add compatibility with non-Windows systems
     #override for testing:
     #rd = r"X:\Music\Concerts\Concerts_GD\_Purchased"
-    rd = str(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Verify all *.ffp files in subfolders of a directory')
+    parser.add_argument('directory')
+    parser.add_argument('--fast', action='store_true', help='only compare the STREAMINFO MD5 with the ffp, fully decoding just the tracks in today\'s scrub slice')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted run, skipping the files recorded in VerifyJournal.jsonl')
+    parser.add_argument('--md5', action='store_true', help='also verify the .md5 files in folders that have no ffp')
+    args = parser.parse_args()
+    rd = str(args.directory)
     while rd[-1:] in ["'"]:
         rd = rd[:len(rd)-1]
     while rd[0] in ["'"]:
         rd = rd[1:]
     rd = fix_directory_name(rd)
-    main(rd)
+    main(rd, tier = 'fast' if args.fast else 'full', resume = args.resume, checkmd5 = args.md5)
 
  
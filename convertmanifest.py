@@ -0,0 +1,74 @@
+"""This module is not intended for execution. It contains the manifest of completed conversions of a batch so an interrupted batch can be resumed"""
+import os
+import json
+import threading
+from pathlib import Path
+
+
+class convertmanifest:
+    """
+    Manifest of converted tracks, one JSON object per line: the source file, the output file and the WAV data MD5 of the audio.
+    A track is only recorded once its output is verified and in place, every entry is flushed to disk as it is written.
+    A track is complete when it has an entry and neither the source nor the output changed since (size and mtime), everything else is converted again.
+    """
+    def __init__ (self, path: str):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.load()
+        self.file = open(path, 'a', encoding='utf-8')
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b'\n'
+            if partial:
+                #end the partly written line so the next entry starts on its own line
+                self.file.write('\n')
+
+    @staticmethod
+    def key(path: str):
+        return Path(os.path.abspath(path)).as_posix()
+
+    @staticmethod
+    def fileid(path: str):
+        """(size, mtime_ns) of path, None if it does not exist"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return [st.st_size, st.st_mtime_ns]
+
+    def load(self):
+        """read the entries of previous runs, a partly written last line from an interrupted run is ignored"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[entry['source']] = entry
+        except FileNotFoundError:
+            pass
+
+    def completed(self, source: str, output: str):
+        """return the md5 recorded for source if output is the unchanged result of its conversion, otherwise None"""
+        entry = self.entries.get(self.key(source))
+        if entry is None or entry['output'] != self.key(output):
+            return None
+        if entry['source_id'] != self.fileid(source) or entry['output_id'] != self.fileid(output):
+            return None
+        return entry['md5']
+
+    def record(self, source: str, output: str, md5: str):
+        """record a conversion, called once output has been renamed into place"""
+        entry = {'source': self.key(source), 'source_id': self.fileid(source),
+                 'output': self.key(output), 'output_id': self.fileid(output), 'md5': md5}
+        with self.lock:
+            self.entries[entry['source']] = entry
+            self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,132 @@
+"""This module is not intended for execution. It contains a work queue that limits how many files are read at once from each storage device"""
+import os
+import threading
+import concurrent.futures
+from collections import deque
+from filefolder_org import load_config
+
+config_file = os.path.join(os.path.dirname(__file__),"config.toml")
+config = load_config(config_file)
+#number of files read at once from a single disk, 0 = no limit per device so the workers of the pool ([verify]/[executor] workers) set the concurrency.
+#on a single spinning disk a few (e.g. 4) keeps the queue full without thrashing the heads. It caps the pool size for a library on one device.
+DeviceWorkers = config.get('io', {}).get('device_workers', 0)
+#overrides per mount point/drive, e.g. a NAS share can take more requests at once than a single spinning disk
+DeviceOverrides = config.get('io', {}).get('devices', {})
+
+
+def get_device(path: str, st: os.stat_result = None):
+    """return the st_dev of a path, None if it cannot be read"""
+    try:
+        return (st if st != None else os.stat(path)).st_dev
+    except OSError:
+        return None
+
+def positive_limit(workers):
+    """a configured limit, None (no limit) for 0 or less"""
+    return int(workers) if workers and int(workers) > 0 else None
+
+def device_limits(overrides: dict = None):
+    """map the configured paths to their st_dev so they can be looked up per file. 0 means no limit for that device, the same as for device_workers"""
+    limits = {}
+    for path, workers in (overrides if overrides != None else DeviceOverrides).items():
+        dev = get_device(path)
+        if dev is not None:
+            limits[dev] = positive_limit(workers)
+    return limits
+
+def location_key(path: str, st: os.stat_result = None):
+    """sort key to read files on a device in directory then inode order, which keeps reads close together on disk"""
+    try:
+        ino = (st if st != None else os.stat(path)).st_ino
+    except OSError:
+        ino = 0
+    return (os.path.dirname(path), ino, path)
+
+
+class devicequeue:
+    """
+    Submit work to an executor while limiting how many items run at once for each storage device (st_dev).
+    Items for a device start in the order they were added. Items for a busy device wait in its backlog while other devices keep working.
+    Without a limit for a device (default_limit, [io] device_workers or [io.devices]) its items only wait for a free worker of the executor.
+    """
+    def __init__ (self, executor, default_limit: int = None, limits: dict = None):
+        self.executor = executor
+        self.default_limit = default_limit if default_limit else DeviceWorkers
+        self.limits = limits if limits != None else device_limits()
+        self.backlog = {}
+        self.running = {}
+        self.inflight = {}
+
+    def limit(self, dev):
+        """number of items run at once for dev, None for no limit"""
+        return positive_limit(self.limits.get(dev, self.default_limit))
+
+    def submit(self, dev, tag, fn, *args):
+        """queue fn(*args) for device dev, tag is returned with the future when it completes"""
+        self.backlog.setdefault(dev, deque()).append((tag, fn, args))
+        self._dispatch(dev)
+
+    def pending(self):
+        """number of items queued or running"""
+        return len(self.inflight) + sum(len(q) for q in self.backlog.values())
+
+    def wait(self):
+        """wait for at least one item to complete, returns a list of (tag, future)"""
+        if not self.inflight:
+            return []
+        done, _ = concurrent.futures.wait(self.inflight, return_when=concurrent.futures.FIRST_COMPLETED)
+        completed = []
+        for future in done:
+            dev, tag = self.inflight.pop(future)
+            self.running[dev] -= 1
+            completed.append((tag, future))
+            self._dispatch(dev)
+        return completed
+
+    def drain(self):
+        """generate (tag, future) for every remaining item as they complete"""
+        while self.inflight:
+            for completed in self.wait():
+                yield completed
+
+    def _dispatch(self, dev):
+        queue = self.backlog.get(dev)
+        limit = self.limit(dev)
+        while queue and (limit is None or self.running.get(dev, 0) < limit):
+            tag, fn, args = queue.popleft()
+            self.running[dev] = self.running.get(dev, 0) + 1
+            self.inflight[self.executor.submit(fn, *args)] = (dev, tag)
+
+
+class devicelimiter:
+    """
+    Limit how many items run at once for each storage device when several threads submit to one shared executor, e.g. the header reads of many folders.
+    Unlike devicequeue it is thread safe: submit blocks the calling thread until the device has a free slot, which is given back when the item completes.
+    """
+    def __init__ (self, default_limit: int = None, limits: dict = None):
+        self.default_limit = default_limit if default_limit else DeviceWorkers
+        self.limits = limits if limits != None else device_limits()
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, dev):
+        """the semaphore of dev, None if it has no limit"""
+        with self.lock:
+            if dev not in self.semaphores:
+                limit = positive_limit(self.limits.get(dev, self.default_limit))
+                self.semaphores[dev] = threading.BoundedSemaphore(limit) if limit else None
+            return self.semaphores[dev]
+
+    def submit(self, executor, dev, fn, *args):
+        """submit fn(*args) to executor once device dev has a free slot, returns the future"""
+        semaphore = self.semaphore(dev)
+        if semaphore is None:
+            return executor.submit(fn, *args)
+        semaphore.acquire()
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda future: semaphore.release())
+        return future
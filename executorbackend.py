@@ -0,0 +1,182 @@
+"""This module is not intended for execution. It contains the executor backends used for verification and checksum generation, and a calibration run to pick one for the current machine"""
+import os
+import json
+import time
+import platform
+import concurrent.futures
+from datetime import datetime
+from filefolder_org import load_config
+from devicequeue import devicequeue
+
+config_file = os.path.join(os.path.dirname(__file__),"config.toml")
+config = load_config(config_file)
+ExecutorConfig = config.get('executor', {})
+
+#'thread' suits work that waits on subprocesses or the disk, 'process' suits decoding/hashing in python,
+#'hybrid' runs the items flagged as cpu bound in processes and everything else in threads
+BACKENDS = ('thread', 'process', 'hybrid')
+DEFAULT_CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), "executor_calibration.json")
+#files each calibration candidate reads per worker, so every worker is kept busy for a while
+CALIBRATION_FILES_PER_WORKER = 2
+
+
+def default_workers(backend: str):
+    """worker count used when none is configured or calibrated"""
+    cpus = os.cpu_count() or 1
+    if backend == 'process':
+        return cpus
+    #same default as ThreadPoolExecutor
+    return min(32, cpus + 4)
+
+def candidate_workers(backend: str):
+    """worker counts calibrate tries for a backend, around the number of cores"""
+    cpus = os.cpu_count() or 1
+    if backend == 'process':
+        return sorted({max(1, cpus // 2), cpus, cpus * 2})
+    #threads mostly wait on the disk or a subprocess, so more of them than cores can pay off
+    return sorted({cpus, default_workers(backend), cpus * 2, cpus * 4})
+
+class hybridexecutor(concurrent.futures.Executor):
+    """
+    Executor that sends the calls cpu_bound(fn, args) returns True for to a process pool sized to the cores, and all other calls to a thread pool.
+    The thread side keeps plenty of disk/subprocess requests in flight while python decoding is spread across cores.
+    """
+    def __init__ (self, max_workers: int = None, cpu_bound = None):
+        self.cpu_bound = cpu_bound if cpu_bound != None else (lambda fn, args: False)
+        self.threads = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.processes = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+
+    def submit(self, fn, /, *args, **kwargs):
+        pool = self.processes if self.cpu_bound(fn, args) else self.threads
+        return pool.submit(fn, *args, **kwargs)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.threads.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self.processes.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+def make_executor(backend: str, max_workers: int = None, cpu_bound = None):
+    """create the executor for a backend, see BACKENDS"""
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown executor backend: {backend}. Expected one of {BACKENDS}')
+    max_workers = max_workers if max_workers else default_workers(backend)
+    if backend == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers)
+    if backend == 'hybrid':
+        return hybridexecutor(max_workers, cpu_bound)
+    return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+def calibration_key(task: str, path: str):
+    """calibrations are stored per task, machine and storage device"""
+    try:
+        dev = os.stat(path).st_dev
+    except OSError:
+        dev = None
+    return f'{platform.node()}|{task}|{dev}'
+
+def load_calibration(task: str, path: str, calibration_file: str = None):
+    """return the stored (backend, workers) for the task and the device path is on, or None if it was never calibrated"""
+    try:
+        with open(calibration_file if calibration_file else DEFAULT_CALIBRATION_FILE, encoding='utf-8') as f:
+            entry = json.load(f).get(calibration_key(task, path))
+    except (FileNotFoundError, ValueError):
+        return None
+    return (entry['backend'], entry['workers']) if entry else None
+
+def save_calibration(task: str, path: str, backend: str, workers: int, rate: float, calibration_file: str = None):
+    calibration_file = calibration_file if calibration_file else DEFAULT_CALIBRATION_FILE
+    try:
+        with open(calibration_file, encoding='utf-8') as f:
+            calibrations = json.load(f)
+    except (FileNotFoundError, ValueError):
+        calibrations = {}
+    calibrations[calibration_key(task, path)] = {'backend': backend, 'workers': workers, 'bytes_per_second': round(rate),
+                                                 'calibrated': datetime.now().isoformat(timespec='seconds')}
+    with open(calibration_file, 'w', encoding='utf-8') as f:
+        json.dump(calibrations, f, indent=2)
+
+def time_candidate(fn, sample: list, backend: str, workers: int, cpu_bound = None, queued: bool = True):
+    """
+    Run fn(*args) for every (size, dev, args) in sample and return the bytes per second.
+    With queued the items go through a devicequeue as they do in verifyscheduler, so a per-device limit ([io] device_workers) applies to the calibration too.
+    """
+    start = time.perf_counter()
+    with make_executor(backend, workers, cpu_bound) as executor:
+        if queued:
+            queue = devicequeue(executor)
+            for (size, dev, args) in sample:
+                queue.submit(dev, None, fn, *args)
+            for (tag, future) in queue.drain():
+                future.result()
+        else:
+            for future in concurrent.futures.as_completed([executor.submit(fn, *args) for (size, dev, args) in sample]):
+                future.result()
+    elapsed = max(time.perf_counter() - start, 1e-6)
+    return sum(size for (size, dev, args) in sample) / elapsed
+
+def calibration_size():
+    """
+    files a calibration needs so that every candidate gets CALIBRATION_FILES_PER_WORKER files per worker of its own:
+    each backend at its default worker count, then the largest sweep of candidate_workers
+    """
+    first = [(backend, default_workers(backend)) for backend in BACKENDS]
+    sweep = max(sum(workers for workers in candidate_workers(backend) if (backend, workers) not in first) for backend in BACKENDS)
+    return CALIBRATION_FILES_PER_WORKER * (sum(workers for (backend, workers) in first) + sweep)
+
+def calibrate(fn, items: list, candidates: list = None, cpu_bound = None, queued: bool = True):
+    """
+    Time fn(*args) for a sample of work and return (backend, workers, bytes_per_second) of the fastest candidate, None if the sample was too small for any.
+    items is a list of (size_in_bytes, st_dev, args). Each candidate gets its own CALIBRATION_FILES_PER_WORKER files per worker from the sample,
+    so files cached by an earlier candidate don't favor a later one. A candidate the rest of the sample can't provide for is not timed, see calibration_size.
+    Without candidates, each backend is timed with its default worker count and then the worker counts of candidate_workers are swept for the fastest one.
+    """
+    timed = {}
+    position = 0
+
+    def run(backend, workers):
+        nonlocal position
+        count = CALIBRATION_FILES_PER_WORKER * workers
+        if position + count > len(items):
+            print(f'Calibration: {backend} with {workers} workers skipped, the sample has too few files left')
+            return
+        sample = items[position:position + count]
+        position += count
+        rate = time_candidate(fn, sample, backend, workers, cpu_bound, queued)
+        print(f'Calibration: {backend} with {workers} workers, {rate / 1048576:.1f} MiB/s')
+        timed[(backend, workers)] = rate
+
+    for (backend, workers) in (candidates if candidates is not None else [(backend, default_workers(backend)) for backend in BACKENDS]):
+        run(backend, workers)
+    if not timed:
+        return None
+    if candidates is None:
+        backend = max(timed, key=timed.get)[0]
+        for workers in candidate_workers(backend):
+            if (backend, workers) not in timed:
+                run(backend, workers)
+    (backend, workers), rate = max(timed.items(), key=lambda x: x[1])
+    return backend, workers, rate
+
+def select_backend(task: str, path: str, fn, sample, cpu_bound = None, queued: bool = True):
+    """
+    Return the (backend, workers) to use for a task on the device path is on.
+    A backend set in [executor] of config.toml is used as is. With 'auto' the stored calibration is used, or one is run on sample and stored.
+    sample(count) is called to produce count calibration items (see calibrate) only when a calibration is needed.
+    count is [executor] calibration_files, or when that is 0 what calibration_size asks for.
+    queued is True when the task's items are run through a devicequeue, so the calibration runs them the same way.
+    """
+    backend = ExecutorConfig.get('backend', 'thread')
+    workers = ExecutorConfig.get('workers') or None
+    calibration_file = ExecutorConfig.get('calibration') or None
+    if backend != 'auto':
+        return backend, workers
+    stored = load_calibration(task, path, calibration_file)
+    if stored is not None:
+        return stored
+    items = sample(ExecutorConfig.get('calibration_files') or calibration_size())
+    calibration = calibrate(fn, items, cpu_bound = cpu_bound, queued = queued) if items else None
+    if calibration is None:
+        return 'thread', workers
+    backend, workers, rate = calibration
+    print(f'Selected the {backend} backend with {workers} workers for {task}')
+    save_calibration(task, path, backend, workers, rate, calibration_file)
+    return backend, workers
@@ -10,28 +10,59 @@ pause
 import os
 import subprocess
 import sys
+import argparse
 import logging
 import concurrent.futures
 from filefolder_org import fix_directory_name, get_child_directories,remove_empty_file,load_config
 from datetime import datetime
-from losslessfiles import ffp
+from losslessfiles import ffp,read_flac_fingerprint,read_flac_fingerprint_deep
+from devicequeue import devicequeue,devicelimiter,get_device,location_key
+from executorbackend import select_backend,make_executor,calibration_size,ExecutorConfig
 from pathlib import Path
 
 def check_folder_for_checksums(DirectoryName):
     """This function will check if a ffp file exists in the specified directory"""
-    ffpexists = False
-    for fname in os.listdir(DirectoryName):
-        if fname.lower().endswith(".ffp"):
-            ffpexists = True
-            break
-    return ffpexists
+    return len(get_ffp_files(DirectoryName)) > 0
 
-def generate_checksums_for_folder(DirectoryName: str,PathToMetaflac: str):
+def get_ffp_files(DirectoryName):
+    """list the ffp files in the specified directory"""
+    return [fname for fname in os.listdir(DirectoryName) if fname.lower().endswith(".ffp")]
+
+def update_checksums_for_folder(DirectoryName: str,PathToMetaflac: str,executor = None,deep: bool = False,limiter = None):
+    """add the tracks missing from the existing ffp and drop the entries for deleted tracks, rewriting the ffp only if something changed. returns the ffp, None if the folder does not have exactly one"""
+    ffpnames = get_ffp_files(DirectoryName)
+    if len(ffpnames) != 1:
+        Err = f"Cannot update {DirectoryName}/, expected one ffp file but found {len(ffpnames)}: {ffpnames}"
+        print(Err)
+        logging.error(Err)
+        return
+    DirectoryName = Path(DirectoryName).as_posix()
+    ffpFile = ffp(DirectoryName,ffpnames[0],{},metaflacpath = PathToMetaflac)
+    ffpFile.readffpfile()
+    if not ffpFile.errors:
+        added, removed = ffpFile.update_checksums(executor, deep, limiter)
+        for key in added:
+            print(f"Added to {ffpFile.name}: {key}")
+        for key in removed:
+            print(f"Removed from {ffpFile.name}: {key}")
+        if not ffpFile.errors:
+            if added or removed:
+                ffpFile.SaveFfp()
+            else:
+                print(f"ffp up to date in:  {DirectoryName}/")
+    for Err in ffpFile.errors:
+        logging.error(Err)
+    return ffpFile
+
+def generate_checksums_for_folder(DirectoryName: str,PathToMetaflac: str,executor = None,deep: bool = False,update: bool = False,limiter = None):
+    """generate the ffp of a folder that has none (or update it, see update_checksums_for_folder), returns the ffp or None if the folder already had one"""
     chkffp = check_folder_for_checksums(DirectoryName)
     if chkffp:
+        if update:
+            return update_checksums_for_folder(DirectoryName,PathToMetaflac,executor,deep,limiter)
         #don't create ffp if one already exists
         print(f"ffp exists in:  {DirectoryName}/")
-        return ([],None)
+        return None
     else:
         DirectoryName = Path(DirectoryName).as_posix()
         ParentDirectoryName = Path(DirectoryName).parent.as_posix() +'/'
@@ -39,14 +70,29 @@ def generate_checksums_for_folder(DirectoryName: str,PathToMetaflac: str):
         print(f'{DirectoryName=} {ffpName=}')
         ffpFile = ffp(DirectoryName,ffpName,metaflacpath = PathToMetaflac)
         if not ffpFile.errors:
-            ffpFile.generate_checksums()
+            ffpFile.generate_checksums(executor, deep, limiter)
         if not ffpFile.errors:
             ffpFile.SaveFfp()
         for Err in ffpFile.errors:
             logging.error(Err)
-    #return ffpFile
+        return ffpFile
+
+def calibration_sample(folders, count = None):
+    """collect the first few flac files as (size, device, args) for calibrating the executor backend on header reads, which is the work generating checksums does"""
+    count = count if count else (ExecutorConfig.get('calibration_files') or calibration_size())
+    sample = []
+    for dirnm in folders:
+        for path, directories, files in os.walk(dirnm):
+            for file in files:
+                if file.lower().endswith(".flac"):
+                    filepath = os.path.join(path, file)
+                    st = os.stat(filepath)
+                    sample.append((st.st_size, st.st_dev, (filepath,)))
+                    if len(sample) >= count:
+                        return sample
+    return sample
 
-def Main(DirectoryName):
+def Main(DirectoryName, deep = False, update = False):
     date = datetime.now().strftime('%Y%m%d%H%M%S') #date for the log name
     logger = logging.getLogger(__name__)
     logfilename = f'{DirectoryName}/Generate_Checksums{date}.log'
@@ -58,8 +104,28 @@ def Main(DirectoryName):
     PathToMetaflac = config['supportfiles']['metaflac']
     list_subfolders_with_paths = get_child_directories(DirectoryName)
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(generate_checksums_for_folder, dirnm,PathToMetaflac): dirnm for dirnm in list_subfolders_with_paths}
+    #group the folders by storage device and limit the folders processed at once on each, reading each device in directory/inode order
+    folders = [(get_device(dirnm), location_key(dirnm), dirnm) for dirnm in list_subfolders_with_paths]
+    folders.sort(key=lambda x: (str(x[0]), x[1]))
+    #deep mode decodes every track, hybrid/process backends (or auto) spread the decoding across processes
+    fingerprintfn = read_flac_fingerprint_deep if deep else read_flac_fingerprint
+    cpu_bound = lambda fn, args: fn is read_flac_fingerprint_deep
+    backend, workers = select_backend('generate:deep' if deep else 'generate', DirectoryName, fingerprintfn,
+                                      lambda count: calibration_sample([x[2] for x in folders], count), cpu_bound = cpu_bound, queued = False)
+    #the header reads of every folder share one pool, so a large box set is read in parallel without exceeding the overall worker budget.
+    #the folder level threads only walk the folders and wait on their reads, the limiter keeps the reads on each device within [io] device_workers.
+    limiter = devicelimiter()
+    with make_executor(backend, workers, cpu_bound) as readers, concurrent.futures.ThreadPoolExecutor() as executor:
+        queue = devicequeue(executor)
+        for (dev, key, dirnm) in folders:
+            queue.submit(dev, dirnm, generate_checksums_for_folder, dirnm,PathToMetaflac,readers,deep,update,limiter)
+        for (dirnm, future) in queue.drain():
+            try:
+                future.result()
+            except Exception as e:
+                Err = f"Error generating checksums for {dirnm}: {e}"
+                print(Err)
+                logging.error(Err)
     logging.shutdown()
     remove_empty_file(logfilename)
 
@@ -68,11 +134,16 @@ if __name__ == "__main__":
     
 
     #rootdirectory = r'X:\Downloads\_Extract\Phish'
-    rootdirectory = str(sys.argv[1])
+    parser = argparse.ArgumentParser(description='Generate an ffp file in each subfolder of a directory that does not have one')
+    parser.add_argument('directory')
+    parser.add_argument('--deep', action='store_true', help='decode every track and only write the ffp when the STREAMINFO MD5 of every file matches its decoded audio')
+    parser.add_argument('--update', action='store_true', help='also bring existing ffp files up to date, adding new tracks and dropping deleted ones')
+    args = parser.parse_args()
+    rootdirectory = str(args.directory)
     while rootdirectory[-1:] in ["'"]:
         rootdirectory = rootdirectory[:len(rootdirectory)-1]
     while rootdirectory[0] in ["'"]:
         rootdirectory = rootdirectory[1:]
     rootdirectory = fix_directory_name(rootdirectory)
     #print(f'{rootdirectory=}')
-    Main(rootdirectory)
+    Main(rootdirectory, deep = args.deep, update = args.update)
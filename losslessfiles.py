@@ -3,27 +3,74 @@ import subprocess
 from pathlib import Path
 from filefolder_org import remove_empty_file,load_config
 from mutagen.flac import FLAC
-#import soundfile as sf
+try:
+    #optional, only needed for the in-process 'native' verification engine
+    import numpy as np
+    import soundfile as sf
+except ImportError:
+    np = None
+    sf = None
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor, as_completed #need to reconcile this with the above at some point. 
 import hashlib
 import re
+import zlib
+from datetime import date
+from devicequeue import devicequeue,devicelimiter,get_device,location_key
+from executorbackend import make_executor,default_workers
+from signaturefiles import read_signature_file,parse_signature_lines
+try:
+    #optional, only needed for [shn] decoder = "native"
+    from shndecoder import shnstream
+except ImportError:
+    shnstream = None
 
 config_file = os.path.join(os.path.dirname(__file__),"config.toml")
 config = load_config(config_file)
 PathToFlac = config['supportfiles']['flac']
 PathToMetaflac = config['supportfiles']['metaflac']
+VerifyEngine = config.get('verify', {}).get('engine', 'flac')
+PathToShorten = config['supportfiles'].get('shorten')
+St5Engine = config.get('st5', {}).get('engine', 'shntool')
+ShnDecoder = config.get('shn', {}).get('decoder', 'shorten')
+#hash the source .shn again with shntool/shorten when the native decoder converts it, see shntoflac_batch.finish_folder
+ShnCrossCheck = config.get('shn', {}).get('crosscheck', False)
+ScrubDays = config.get('verify', {}).get('scrub_days', 30)
 
 #print(f'{PathToFlac=} {PathToMetaflac=}')
 
-
-
-
-def generate_st5_for_folder(shntool_exe: str, folder: str, st5_filename: str,audiofiles:list):
+#'flac' runs flac --test for each file, 'native' decodes and hashes the audio in-process (requires numpy and soundfile)
+#'header' only compares the STREAMINFO MD5 with the ffp, which finds renamed/replaced files but not corrupt audio
+VERIFY_ENGINES = ('flac', 'native', 'header')
+#'full' decodes every track, 'fast' checks headers only and fully decodes the tracks in today's scrub slice
+VERIFY_TIERS = ('full', 'fast')
+#number of frames decoded at a time by the native engine, keeps memory use bounded regardless of track length
+DECODE_BLOCK_FRAMES = 65536
+#read buffer for the native engine, the header and the start of the audio are served from the first read
+READ_BUFFER_SIZE = 1024 * 1024
+#read size when hashing whole files for md5 verification
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+#header reads at once within one album when generate_checksums is not given a shared executor
+GENERATE_READ_WORKERS = 8
+#fLaC marker + metadata block header + STREAMINFO
+STREAMINFO_SIZE = 42
+#'shntool' runs shntool hash -m for each file, 'native' hashes the decoded audio in-process (flac requires numpy and soundfile, shn is decoded by shorten)
+ST5_ENGINES = ('shntool', 'native')
+#'shorten' runs shorten -x for each .shn, 'native' decodes them in-process with shndecoder (requires numpy)
+SHN_DECODERS = ('shorten', 'native')
+#line written by shntool hash -m
+ST5_LINE = '{md5}  [shntool]  {name}\n'
+
+
+
+
+def generate_st5_for_folder(shntool_exe: str, folder: str, st5_filename: str,audiofiles:list, engine: str = None):
     """
     In 'folder', run:
       shntool.exe hash -m *.flac > st5_filename
     capturing stdout => st5_filename.
+    engine is one of ST5_ENGINES, defaults to the [st5] engine in config.toml. 'native' writes the same lines without starting shntool, see generate_st5_for_file_native
+    returns (st5_path, returncode, records), records are the (file, md5) of the st5 lines so they can be compared without reading the file back
     """
     #cmd = [
     #    shntool_exe,
@@ -36,23 +83,43 @@ def generate_st5_for_folder(shntool_exe: str, folder: str, st5_filename: str,aud
     #proc = subprocess.run(cmd, cwd=folder, capture_output=True, text=True)
     #with open(st5_path, "w", encoding="utf-8") as f:
     #    f.write(proc.stdout)
+    records, returncode = st5_records_for_files(shntool_exe, folder, audiofiles, engine)
+    write_st5_file(st5_path, records)
+    return (st5_path, returncode, records)
+
+def st5_records_for_files(shntool_exe: str, folder: str, audiofiles: list, engine: str = None, shn_decoder: str = None):
+    """
+    hash audiofiles in 'folder' with the st5 engine (see generate_st5_for_folder), returns ((file, md5) records sorted by file, returncode)
+    shn_decoder is the decoder the native engine uses for .shn files, defaults to the [shn] decoder in config.toml
+    """
+    engine = engine if engine != None else St5Engine
+    if engine not in ST5_ENGINES:
+        raise ValueError(f'Unknown st5 engine: {engine}. Expected one of {ST5_ENGINES}')
     st5_results = []
     with ThreadPoolExecutor () as executor:
             #futures = {executor.submit(verifyflacfile, filenm,checksum,self.flacpath,self.metaflacpath,self.name,self.location): \
             #        (filenm,checksum) for (filenm,checksum) in list(self.signatures.items())}        
-        futures = [executor.submit(generate_st5_for_file,shntool_exe,file,folder) for file in audiofiles]
+        if engine == 'native':
+            futures = [executor.submit(generate_st5_for_file_native,file,folder,None,shn_decoder) for file in audiofiles]
+        else:
+            futures = [executor.submit(generate_st5_for_file,shntool_exe,file,folder) for file in audiofiles]
         for future in as_completed(futures):
             message = future.result()
             st5_results.append(message)
 
-        st5data = ''.join([x[2] for x in sorted(st5_results)])
+        st5data = ''.join([x[2] for x in sorted(st5_results, key=lambda x: x[0])])
         returncode = 0
-        for rc in [x[1] for x in sorted(st5_results)]:
+        for (file, rc, stdout, stderr, proc) in sorted(st5_results, key=lambda x: x[0]):
             if rc !=0:
                 returncode= rc
+                if engine == 'native':
+                    print(stderr)
+    return (list(parse_signature_lines(st5data, 'st5')), returncode)
+
+def write_st5_file(st5_path: str, records: list):
+    """write (file, md5) records as shntool hash -m lines, sorted by file"""
     with open(st5_path, "w", encoding="utf-8") as f:
-        f.write(st5data)    
-    return (st5_path, returncode)
+        f.write(''.join(ST5_LINE.format(md5=md5, name=file) for (file, md5) in sorted(records)))
 
 def generate_st5_for_file(shntool_exe: str, file:str, folder: str):
     """
@@ -74,6 +141,127 @@ def generate_st5_for_file(shntool_exe: str, file:str, folder: str):
     #    f.write(proc.stdout)
     return (file,proc.returncode, proc.stdout, proc.stderr,proc)
 
+def generate_st5_for_file_native(file: str, folder: str, shorten_exe: str = None, shn_decoder: str = None):
+    """
+    The st5 line of one file without running shntool, returns the same (file, returncode, stdout, stderr, proc) as generate_st5_for_file with proc None.
+    shntool hashes the data chunk of the WAV the file decodes to: .wav files are hashed as they are, .shn files are decoded by shorten to a pipe (or by shndecoder, see [shn] decoder) and .flac files are decoded in-process.
+    """
+    try:
+        md5 = wav_data_md5_of_file(os.path.join(folder, file), shorten_exe, shn_decoder)
+    except Exception as e:
+        return (file, 1, '', f'Error hashing {folder}/{file}: {e}', None)
+    return (file, 0, ST5_LINE.format(md5=md5, name=file), '', None)
+
+def wav_data_md5_of_file(filepath: str, shorten_exe: str = None, shn_decoder: str = None):
+    """MD5 of the WAV data chunk filepath decodes to, the value shntool hash -m reports. shn_decoder is one of SHN_DECODERS, defaults to the [shn] decoder"""
+    extension = os.path.splitext(filepath)[1].lower()
+    shn_decoder = shn_decoder if shn_decoder != None else ShnDecoder
+    if extension == '.wav':
+        with open(filepath, 'rb', buffering=READ_BUFFER_SIZE) as f:
+            return wav_data_md5(f)
+    if extension == '.shn' and shn_decoder == 'native':
+        if shnstream is None:
+            raise Exception("The native shn decoder requires numpy to be installed")
+        with shnstream(filepath) as f:
+            return wav_data_md5(f)
+    if extension == '.shn':
+        shorten_exe = shorten_exe if shorten_exe != None else PathToShorten
+        proc = subprocess.Popen([shorten_exe, '-x', filepath, '-'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            md5 = wav_data_md5(proc.stdout)
+        finally:
+            #read whatever is left so shorten can exit
+            stdout, stderr = proc.communicate()
+        if proc.returncode != 0:
+            raise Exception(f"shorten returned {proc.returncode}: {stderr.decode('utf-8', 'replace').strip()}")
+        return md5
+    with open(filepath, 'rb', buffering=READ_BUFFER_SIZE) as f:
+        fingerprint, bits_per_sample = streaminfo_from_stream(f)
+        return calcflacfingerprint(f, bits_per_sample, wavdata = True)
+
+class teestream:
+    """binary reader that copies everything read from stream to out, e.g. to hash a decoder's output while it is piped into an encoder"""
+    def __init__ (self, stream, out):
+        self.stream = stream
+        self.out = out
+
+    def read(self, size: int = -1):
+        data = self.stream.read(size)
+        if data:
+            self.out.write(data)
+        return data
+
+class sizedstream:
+    """
+    binary reader over an open file that answers seeks to the end from os.fstat.
+    soundfile gets the file length by seeking to the end and back, which on a buffered file drops the buffer and reads the start of the file a second time.
+    """
+    def __init__ (self, stream):
+        self.stream = stream
+        self.size = os.fstat(stream.fileno()).st_size
+        #position after a seek to the end, the underlying stream is only moved there if it is read from
+        self.endpos = None
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET):
+        if whence == os.SEEK_END:
+            self.endpos = self.size + offset
+            return self.endpos
+        if whence == os.SEEK_CUR and self.endpos is not None:
+            offset, whence = self.endpos + offset, os.SEEK_SET
+        self.endpos = None
+        return self.stream.seek(offset, whence)
+
+    def tell(self):
+        return self.endpos if self.endpos is not None else self.stream.tell()
+
+    def _moveto_end(self):
+        if self.endpos is not None:
+            self.stream.seek(self.endpos)
+            self.endpos = None
+
+    def read(self, size: int = -1):
+        self._moveto_end()
+        return self.stream.read(size)
+
+    def readinto(self, buffer):
+        self._moveto_end()
+        return self.stream.readinto(buffer)
+
+def wav_data_md5(stream, buffersize: int = READ_BUFFER_SIZE):
+    """
+    MD5 of the data chunk of a RIFF WAVE stream, read sequentially so it works on a pipe.
+    A data chunk size of 0 or 0xFFFFFFFF (written by decoders that cannot seek back to fill it in) means the data runs to the end of the stream.
+    """
+    header = stream.read(12)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise Exception("Not a RIFF WAVE stream")
+    while True:
+        chunk = stream.read(8)
+        if len(chunk) < 8:
+            raise Exception("No data chunk found")
+        chunkid, size = chunk[:4], int.from_bytes(chunk[4:8], 'little')
+        if chunkid == b'data':
+            break
+        #chunks are padded to an even size
+        skip = size + (size & 1)
+        while skip > 0:
+            skipped = stream.read(min(skip, buffersize))
+            if not skipped:
+                raise Exception("Truncated WAV header")
+            skip -= len(skipped)
+    md5hash = hashlib.md5()
+    remaining = None if size in (0, 0xFFFFFFFF) else size
+    while remaining is None or remaining > 0:
+        data = stream.read(buffersize if remaining is None else min(remaining, buffersize))
+        if not data:
+            if remaining is not None:
+                raise Exception(f"WAV data ends {remaining} bytes early")
+            break
+        md5hash.update(data)
+        if remaining is not None:
+            remaining -= len(data)
+    return md5hash.hexdigest()
+
 
 class ffp:
     def __init__ (self, location: str, name: str, signatures: dict ={}, metaflacpath: str = None, flacpath: str = None):
@@ -87,55 +275,22 @@ class ffp:
         self.result = []
 
     def readffpfile(self):
-        """split ffp file into dictionary with full file path as key and signature as value"""
+        """split ffp file into dictionary with full file path as key and signature as value
+        .md5 and .st5 files can be read the same way, the format follows the extension, see signaturefiles"""
         ffpName = f'{self.location}/{self.name}'
-        msg = None
-        ffp_sigs = {}
-        try: 
-            ffp = open(ffpName, encoding="utf-8")
-        except Exception as e:
-            msg = f'Error reading file {ffpName}: {e}'
-            print(msg)
-            self.errors.append(msg)
-        #Attempt to read the first line of the ffp file to determine if it is not encoded using utf-8. If an error occurs, reopen without the encoding parameter.
         try:
-            firstline = ffp.readline()
-            ffp.close()
-            ffp = open(ffpName, encoding="utf-8")
-        except UnicodeDecodeError:
-            ffp.close()
-            try: 
-                ffp = open(ffpName)
-            except Exception as e:
-                msg = f'Error reading file {ffpName}: {e}'
-                self.errors.append(msg)
-                print(msg)             
-        try:
-            for line in ffp:
-                    if not line.startswith(';') and ':' in line:
-                        ffp_line = line.strip().replace('\\','/')
-                        ffp_parts = ffp_line[::-1].split(':',1)
-                        ffp_sigs[ffp_parts[1][::-1]] = ffp_parts[0][::-1]
-                    else: #old format seen in some files. 
-                        if not line.startswith(';') and '*' in line:
-                            ffp_line = line.strip().replace('\\','/')
-                            ffp_parts = ffp_line[::-1].split('*',1)
-                            ffp_sigs[ffp_parts[0][::-1].strip()] = ffp_parts[1][::-1].strip()
-            self.signatures = ffp_sigs
+            self.signatures = read_signature_file(ffpName)
         except Exception as e:
             msg = f'Error reading file {ffpName}: {e}'
-            #print(msg)
+            print(msg)
             self.errors.append(msg)
             #logger.error(msg)                    
-        
-        #return ffpFile
 
-    def generate_checksums(self):
-        """loop though all files and child directories to generate the checksums for all .flac files, storing them with the relative path"""
+    def find_flac_files(self):
+        """return the full paths of all .flac files in the folder and child directories, in the order they are found. paths that are too long are added to errors"""
         DirectoryName = self.location +'/'
-        ParentDirectoryName = Path(DirectoryName).parent.as_posix()
         b_error = False
-        self.signatures = {}
+        filepaths = []
         for path, directories, files in os.walk(DirectoryName):
             for file in files:
                 if file.lower().endswith(".flac"):
@@ -148,25 +303,45 @@ class ffp:
                         Err = f"Error: {e}" #sys.error(e) 
                         self.errors.append(Err)
                     if not b_error:
-                        try:
-                            #fingerprint = subprocess.check_output('"'+self.metaflacpath+'"'+' --show-md5sum "'+filepath+'"', encoding="utf8")
-                            #with open(filepath, 'rb') as f:
-                            flac_file = FLAC(filepath) #using mutagen prevents the need to call the metaflac cmd. 
-                            fingerprint = ("%02x" % flac_file.info.md5_signature).rjust(32, '0')
-
-                            if fingerprint.strip() == '00000000000000000000000000000000':
-                                b_error = True
-                                Err = f"Error in file: {filepath}. Fingerprint = {fingerprint.strip()}"
-                                self.errors.append(Err)
-                                print(Err)
-                            else:
-                                self.signatures[filepath.replace(DirectoryName,'')] = fingerprint.strip()
-                        except Exception as e:
-                            Err = f"Error: {e}"
-                            self.errors.append(Err)
-                            print(Err)
-                            b_error = True
-        if b_error:
+                        filepaths.append(filepath)
+        return filepaths
+
+    def fingerprint_files(self, filepaths: list, executor = None, deep = False, limiter = None):
+        """
+        read the fingerprints of filepaths in parallel on executor, which can be shared between folders so they draw on one pool of workers. a small local pool is used when none is passed in.
+        limiter is a devicelimiter shared by the folders, so the reads on one device stay within its limit however large the pool is. a new one is used when none is passed in.
+        results are collected in the order of filepaths, so the output does not depend on which read finishes first. returns {relative path: fingerprint}, failures are added to errors
+        with deep=True every track is also decoded and only fingerprints that match the MD5 of the decoded audio are accepted, see read_flac_fingerprint_deep
+        """
+        DirectoryName = self.location +'/'
+        signatures = {}
+        if not filepaths:
+            return signatures
+        fingerprintfn = read_flac_fingerprint_deep if deep else read_flac_fingerprint
+        limiter = limiter if limiter != None else devicelimiter()
+        dev = get_device(self.location)
+        if executor is None:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(filepaths), GENERATE_READ_WORKERS)) as localexecutor:
+                results = [future.result() for future in [limiter.submit(localexecutor, dev, fingerprintfn, filepath) for filepath in filepaths]]
+        else:
+            results = [future.result() for future in [limiter.submit(executor, dev, fingerprintfn, filepath) for filepath in filepaths]]
+        for filepath, (fingerprint, Err) in zip(filepaths, results):
+            if Err != None:
+                self.errors.append(Err)
+                print(Err)
+            else:
+                signatures[filepath.replace(DirectoryName,'')] = fingerprint
+        return signatures
+
+    def generate_checksums(self, executor = None, deep = False, limiter = None):
+        """loop though all files and child directories to generate the checksums for all .flac files, storing them with the relative path
+        see fingerprint_files for executor, deep and limiter"""
+        DirectoryName = self.location +'/'
+        self.signatures = {}
+        filepaths = self.find_flac_files()
+        if not self.errors:
+            self.signatures = self.fingerprint_files(filepaths, executor, deep, limiter)
+        if self.errors:
             print("Error Generating checksums for: "+DirectoryName)
             #return ([],None)
         else:
@@ -175,111 +350,414 @@ class ffp:
                 #return ([],None)
             else:
                 print("Checksums generated for: "+DirectoryName)
-        
+
+    def update_checksums(self, executor = None, deep = False, limiter = None):
+        """
+        bring the signatures read from an existing ffp up to date with the files in the folder: fingerprint only the tracks missing from it and drop the entries of tracks that no longer exist.
+        returns (added, removed) lists of relative paths. nothing is changed if any new track fails, see fingerprint_files for executor, deep and limiter
+        """
+        DirectoryName = self.location +'/'
+        #the ffp may have been written on windows, where file names are not case sensitive
+        normalize = (lambda key: key.lower()) if os.name == 'nt' else (lambda key: key)
+        filepaths = self.find_flac_files()
+        if self.errors:
+            return [], []
+        existing = {normalize(key) for key in self.signatures}
+        ondisk = {normalize(filepath.replace(DirectoryName,'')) for filepath in filepaths}
+        newfiles = [filepath for filepath in filepaths if normalize(filepath.replace(DirectoryName,'')) not in existing]
+        removed = [key for key in self.signatures if normalize(key) not in ondisk]
+        added = self.fingerprint_files(newfiles, executor, deep, limiter)
+        if self.errors:
+            print("Error Updating checksums for: "+DirectoryName)
+            return [], []
+        for key in removed:
+            del self.signatures[key]
+        self.signatures.update(added)
+        return sorted(added), removed
+
     def SaveFfp(self):
-        """This function will create a ffp file in the specified directory using the values passed in"""
+        """This function will create a ffp file in the specified directory using the values passed in
+        the file is written under a temporary name and renamed over the final one, so an existing ffp is never left half written"""
         FileName = self.location +'/' +self.name
+        TempName = FileName + '.tmp'
         if self.signatures:
             try:
                 #output_file = open(FileName, 'w', encoding="utf-8")
-                with open(FileName, 'w', encoding='utf-8') as output_file:
+                with open(TempName, 'w', encoding='utf-8') as output_file:
                 #for key,value in self.signatures.items():
                     for key in sorted(self.signatures):
                         value = self.signatures[key]                
                         output_file.write(key+':'+value + '\n')
                     #output_file.close()
+                os.replace(TempName, FileName)
                 print(f"Created file: {FileName}")
             except Exception as e:
                 #errors may occur occasionally when there is a bad character in a flac filename. Do not create the ffp file if an exception occurs
                 #if output_file.closed == False:
                 #    output_file.close()
-                remove_empty_file(FileName)
+                if os.path.exists(TempName):
+                    os.remove(TempName)
                 print(f"ERROR Creating file: {e}")
         else:
             print(f"No signatures file not created: {FileName}")
     
-    def verify(self, silent = False):
+    def verify(self, silent = False, engine = None, cache = None, tier = 'full'):
         #return None
-        """verify an ffp file"""
-        self.result = []
+        """verify an ffp file. engine is one of VERIFY_ENGINES, defaults to the [verify] engine in config.toml
+        cache is an optional verifycache, files that passed recently and have not changed since are skipped
+        tier is one of VERIFY_TIERS, see verifyscheduler"""
         self.errors = []
-        print(f'Verifying {self.name} in {self.location}:')
-        #a single process is not maxing out the disk when verifying, speed things up a bit...
-        #with concurrent.futures.ProcessPoolExecutor() as executor:
-        #multithreading appears to be a bit faster
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = {executor.submit(verifyflacfile, filenm,checksum,self.flacpath,self.metaflacpath,self.name,self.location): \
-                    (filenm,checksum) for (filenm,checksum) in list(self.signatures.items())}
-            for future in concurrent.futures.as_completed(futures):
-                Err = None
-                message = None
-                Err,message = future.result()
-                if Err == None:
-                    #print(message)
-                    #logger.info(message)
-                    self.result.append(message)
-                else:
-                    self.errors.append(Err)
-                    #logger.error(Err)
-                if not silent:
-                    print('\t'+ message if Err == None else Err)
+        verifyscheduler(engine = engine, cache = cache, silent = silent, tier = tier).run([self])
+
+def read_flac_fingerprint(filepath):
+    """read the STREAMINFO MD5 of a flac file for generating an ffp, returns (fingerprint, Err)"""
+    try:
+        #fingerprint = subprocess.check_output('"'+self.metaflacpath+'"'+' --show-md5sum "'+filepath+'"', encoding="utf8")
+        fingerprint = read_streaminfo(filepath)['md5'] #reading the STREAMINFO directly prevents the need to call the metaflac cmd or parse every metadata block
+        if fingerprint.strip() == '00000000000000000000000000000000':
+            return None, f"Error in file: {filepath}. Fingerprint = {fingerprint.strip()}"
+        return fingerprint.strip(), None
+    except Exception as e:
+        return None, f"Error: {e}"
 
-def verifyflacfile(filenm,checksum,fp,mfp,ffpnm,loc):
+def read_flac_fingerprint_deep(filepath):
+    """
+    read the STREAMINFO MD5 of a flac file and check it against the MD5 of the decoded audio, returns (fingerprint, Err)
+    a file whose stored MD5 does not match its audio is reported as an error, so it never gets written into an ffp where it would then pass verification.
+    """
+    fingerprint, Err = None, None
+    try:
+        with open(filepath, 'rb', buffering=READ_BUFFER_SIZE) as f:
+            fingerprint, bits_per_sample = streaminfo_from_stream(f)
+            if fingerprint == '00000000000000000000000000000000':
+                return None, f"Error in file: {filepath}. Fingerprint = {fingerprint}"
+            rawfingerprint = calcflacfingerprint(f, bits_per_sample)
+    except Exception as e:
+        return None, f"Error decoding file: {filepath}: {e}"
+    if rawfingerprint != fingerprint:
+        return None, f"Error in file: {filepath}. STREAMINFO MD5 {fingerprint} does not match the MD5 of the decoded audio {rawfingerprint}"
+    return fingerprint, None
+
+def verifyflacfile(filenm,checksum,fp,mfp,ffpnm,loc,engine='flac'):
     """check an individual flac file"""
+    if engine == 'native':
+        return verifyflacfile_native(filenm,checksum,ffpnm,loc)
+    if engine == 'header':
+        return verifyflacfile_header(filenm,checksum,ffpnm,loc)
     filepath = loc + '/' + filenm
     Error = None
+    fingerprint = ''
     try:
         #fingerprint = subprocess.check_output('"'+mfp+'"'+' --show-md5sum "'+loc+'/'+filenm+'"', encoding="utf8")
-        flac_file = FLAC(filepath) #using mutagen prevents the need to call the metaflac cmd. 
-        fingerprint = ("%02x" % flac_file.info.md5_signature).rjust(32, '0')        
+        fingerprint = read_streaminfo(filepath)['md5'] #reading the STREAMINFO directly prevents the need to call the metaflac cmd or parse every metadata block
         if fingerprint.strip() == '00000000000000000000000000000000':
             Error = msg = f'Error in file: {filenm}. Path: {filenm} cannot check MD5 signature since it was unset in the STREAMINFO'
     #except  subprocess.CalledProcessError as e:
     except Exception as e:
         #logger.error(e.cmd)
         Error = msg = f"Error: {e}"
+    if Error != None:
+        return Error, msg
     try:
-        #rawfingerprint = calcflacfingerprint(filepath)
-        #if rawfingerprint != fingerprint:
-        #    msg = f"{filenm}:{rawfingerprint} does not match {checksum}."
         checkfile = subprocess.check_output('"'+fp+'"'+' --test --silent "'+loc+'/'+filenm, encoding="utf8")
-        if str(checksum).strip() == fingerprint.strip():
-            msg = f"{filenm}:{checksum} passed."
-        else:
-            Error = msg = f"Error in file: {ffpnm}. Path: {filenm}:{checksum} verified, but does not match signature."
+        Error, msg = compare_signature(filenm,checksum,fingerprint,ffpnm)
     except Exception as e:
         Error = msg = f'Error verifying file: {filenm}:\n\t {e}'
     #print('\t'+msg if Error == None else Error)
     return Error, msg
 
-def calcflacfingerprint(flac_file):
+def verifyflacfile_native(filenm,checksum,ffpnm,loc):
     """
-    Computes the MD5 fingerprint of the raw audio data in the FLAC file.
+    check an individual flac file in-process, equivalent to flac --test followed by comparing the STREAMINFO MD5 to the ffp.
+    The file is opened once and read once: the STREAMINFO is parsed from the start of the same buffered stream that then feeds the decoder.
+    """
+    filepath = loc + '/' + filenm
+    try:
+        with open(filepath, 'rb', buffering=READ_BUFFER_SIZE) as f:
+            try:
+                fingerprint, bits_per_sample = streaminfo_from_stream(f)
+            except Exception as e:
+                Error = msg = f"Error: {e}"
+                return Error, msg
+            if fingerprint == '00000000000000000000000000000000':
+                Error = msg = f'Error in file: {filenm}. Path: {filenm} cannot check MD5 signature since it was unset in the STREAMINFO'
+                return Error, msg
+            rawfingerprint = calcflacfingerprint(f, bits_per_sample)
+        if rawfingerprint != fingerprint:
+            raise Exception(f"MD5 of the decoded audio {rawfingerprint} does not match the STREAMINFO MD5 {fingerprint}")
+        Error, msg = compare_signature(filenm,checksum,fingerprint,ffpnm)
+    except Exception as e:
+        Error = msg = f'Error verifying file: {filenm}:\n\t {e}'
+    return Error, msg
+
+def verifyflacfile_header(filenm,checksum,ffpnm,loc):
+    """fast check of an individual flac file, only compares the STREAMINFO MD5 with the ffp without decoding the audio"""
+    filepath = loc + '/' + filenm
+    try:
+        with open(filepath, 'rb') as f:
+            fingerprint, bits_per_sample = streaminfo_from_stream(f)
+    except Exception as e:
+        Error = msg = f"Error: {e}"
+        return Error, msg
+    if fingerprint == '00000000000000000000000000000000':
+        Error = msg = f'Error in file: {filenm}. Path: {filenm} cannot check MD5 signature since it was unset in the STREAMINFO'
+        return Error, msg
+    Error, msg = compare_signature(filenm,checksum,fingerprint,ffpnm)
+    if Error == None:
+        msg = f"{filenm}:{checksum} passed (header only)."
+    return Error, msg
+
+def in_scrub_slice(filepath: str, scrub_days: int, day: date = None):
+    """
+    True if the file is due for a full decode on the given day (default today).
+    Files are spread over scrub_days slices by a hash of their path, so running daily decodes every file once every scrub_days days.
+    """
+    if not scrub_days or scrub_days <= 1:
+        return True
+    day = day if day != None else date.today()
+    return zlib.crc32(Path(filepath).as_posix().encode('utf-8')) % scrub_days == day.toordinal() % scrub_days
+
+def compare_signature(filenm,checksum,fingerprint,ffpnm):
+    """compare the signature from the ffp with the STREAMINFO MD5 of a file that was tested successfully"""
+    Error = None
+    if str(checksum).strip() == fingerprint.strip():
+        msg = f"{filenm}:{checksum} passed."
+    else:
+        Error = msg = f"Error in file: {ffpnm}. Path: {filenm}:{checksum} verified, but does not match signature."
+    return Error, msg
+
+def parse_streaminfo(header: bytes):
+    """
+    Parse the fLaC marker and STREAMINFO block from the first STREAMINFO_SIZE bytes of a file.
+    Returns a dict with sample_rate, channels, bits_per_sample, total_samples and md5 (hex), or None if the file does not start with them (e.g. it has an ID3 tag in front).
+    """
+    if len(header) < STREAMINFO_SIZE or header[:4] != b'fLaC' or (header[4] & 0x7f) != 0:
+        return None
+    #skip min/max block size (2+2 bytes) and min/max frame size (3+3 bytes)
+    packed = int.from_bytes(header[18:26], 'big')
+    return {'sample_rate': packed >> 44,
+            'channels': ((packed >> 41) & 0x07) + 1,
+            'bits_per_sample': ((packed >> 36) & 0x1f) + 1,
+            'total_samples': packed & 0xfffffffff,
+            'md5': header[26:42].hex()}
+
+def streaminfo_from_stream(f):
+    """
+    Return (md5, bits_per_sample) from the STREAMINFO of an open binary flac stream and rewind it.
+    The header comes out of the stream's buffer, so it costs no extra read. Files that don't start with the STREAMINFO are handed to mutagen on the same stream.
+    """
+    info = parse_streaminfo(f.read(STREAMINFO_SIZE))
+    f.seek(0)
+    if info is None:
+        info = streaminfo_from_mutagen(FLAC(f))
+        f.seek(0)
+    return info['md5'], info['bits_per_sample']
+
+def streaminfo_from_mutagen(flac_file):
+    """the same dict as parse_streaminfo from a mutagen FLAC object"""
+    return {'sample_rate': flac_file.info.sample_rate,
+            'channels': flac_file.info.channels,
+            'bits_per_sample': flac_file.info.bits_per_sample,
+            'total_samples': flac_file.info.total_samples,
+            'md5': ("%02x" % flac_file.info.md5_signature).rjust(32, '0')}
+
+def read_streaminfo(filepath):
+    """
+    Read the STREAMINFO of a flac file with a single unbuffered read of STREAMINFO_SIZE bytes, see parse_streaminfo for the returned dict.
+    Unlike mutagen this doesn't parse the other metadata blocks (tags, embedded pictures, padding). Files that don't start with the STREAMINFO fall back to mutagen.
+    """
+    with open(filepath, 'rb', buffering=0) as f:
+        info = parse_streaminfo(f.read(STREAMINFO_SIZE))
+    if info is None:
+        info = streaminfo_from_mutagen(FLAC(filepath))
+    return info
+
+def calcflacfingerprint(flac_file, bits_per_sample = None, blockframes = DECODE_BLOCK_FRAMES, wavdata = False):
+    """
+    Computes the MD5 fingerprint of the raw audio data in the FLAC file, the same value flac stores in the STREAMINFO.
+    The file is decoded in blocks of blockframes frames and hashed as it is decoded, so memory use does not depend on the track length.
 
     Args:
-        flac_file (str): Path to the FLAC file.
+        flac_file (str): Path to the FLAC file, or an open binary stream positioned at the start of the file.
+        bits_per_sample (int): Bit depth from the STREAMINFO, read from the decoder when not passed in.
+        blockframes (int): Number of frames to decode at a time.
+        wavdata (bool): Hash 8 bit samples unsigned as they are stored in a WAV file, which gives the WAV data MD5 shntool reports. Other bit depths hash the same either way.
 
     Returns:
         str: The computed MD5 fingerprint (as a hexadecimal string).
-    NOTE: This does not detect errors when decoding. 
     """
+    if sf is None or np is None:
+        raise Exception("The native verification engine requires numpy and soundfile to be installed")
+    md5hash = hashlib.md5()
+    if hasattr(flac_file, 'fileno'):
+        #keep the stream's buffer when soundfile asks for the file length, so the file is read once
+        flac_file = sizedstream(flac_file)
     with sf.SoundFile(flac_file, 'r') as f:
+        if bits_per_sample is None:
+            bits_per_sample = {'PCM_S8': 8, 'PCM_16': 16, 'PCM_24': 24}.get(f.subtype)
+            if bits_per_sample is None:
+                raise Exception(f"Unsupported sample format: {f.subtype}")
+        #flac hashes each sample as a little endian signed integer using the smallest number of whole bytes.
+        #libsndfile returns int32 samples left justified, shift them back down and keep the low order bytes.
+        shift = 32 - bits_per_sample
+        samplebytes = (bits_per_sample + 7) // 8
+        framesread = 0
+        for block in f.blocks(blocksize=blockframes, dtype='int32', always_2d=True):
+            framesread += block.shape[0]
+            if shift:
+                block >>= shift
+            if wavdata and bits_per_sample == 8:
+                block += 128
+            md5hash.update(block.astype('<i4', copy=False).view(np.uint8).reshape(-1, 4)[:, :samplebytes].tobytes())
+        if framesread != f.frames:
+            raise Exception(f"Decoding stopped after {framesread} of {f.frames} frames")
+    return md5hash.hexdigest()
+
+class verifyscheduler:
+    """
+    Verify the tracks of any number of ffp files using one long-lived thread pool.
+    md5 files can be passed in with the ffps, their files are hashed whole by verifymd5file in the same pool (engine 'md5', at either tier).
+    Work is submitted as (ffp, track) items so a fixed number of files are always being verified, rather than the pool draining at the end of each ffp.
+    Results and errors are still collected on each ffp, which is printed and passed to on_complete once all of its tracks are done.
+    With tier='fast' only the headers are compared with the ffp, except for the tracks in today's scrub slice (see in_scrub_slice) which are fully decoded with engine.
+    When a verifyjournal is passed in, each result is appended to it and tracks it already holds from an earlier session are not verified again.
+    When a resultsink is passed in, every track's result is also written to it. With keep_results=False the messages of tracks that passed are not kept on the ffp, only the errors.
+    progress (see resultsink.progress) is updated for every track, set silent as well to only print its summary.
+    """
+    def __init__ (self, max_workers: int = None, engine: str = None, cache = None, silent: bool = False, device_workers: int = None,
+                  tier: str = 'full', scrub_days: int = None, journal = None, backend: str = 'thread',
+                  sink = None, progress = None, keep_results: bool = True):
+        self.engine = engine if engine != None else VerifyEngine
+        if self.engine not in VERIFY_ENGINES:
+            raise ValueError(f'Unknown verification engine: {self.engine}. Expected one of {VERIFY_ENGINES}')
+        if tier not in VERIFY_TIERS:
+            raise ValueError(f'Unknown verification tier: {tier}. Expected one of {VERIFY_TIERS}')
+        self.tier = tier
+        self.scrub_days = scrub_days if scrub_days != None else ScrubDays
+        #thread, process or hybrid, see executorbackend. hybrid decodes the native engine's tracks in processes
+        self.backend = backend
+        self.max_workers = max_workers if max_workers else default_workers(backend)
+        #keep a few extra items queued so a worker never waits on the scheduler for its next file
+        self.max_inflight = self.max_workers * 2
+        #limit on files read at once from each device, see devicequeue. Unset, [io] device_workers applies, and without that only max_workers.
+        #a limit below max_workers caps the scheduler at that many files for a library on one device
+        self.device_workers = device_workers
+        self.cache = cache
+        self.journal = journal
+        self.sink = sink
+        self.progress = progress
+        self.keep_results = keep_results
+        self.silent = silent
+
+    def run(self, ffps, on_complete = None):
+        """verify every track of every ffp in ffps (any iterable, consumed as work is needed). ffps that already have errors (e.g. from reading them) are not verified"""
+        self.on_complete = on_complete
+        with make_executor(self.backend, self.max_workers, cpu_bound = lambda fn, args: fn is verifyflacfile and args[-1] == 'native') as executor:
+            #tracks are queued per storage device so busy disks don't hold up idle ones
+            queue = devicequeue(executor, self.device_workers)
+            for (state,filenm,checksum,st,engine) in self._work_items(ffps):
+                while queue.pending() >= self.max_inflight:
+                    for (item, future) in queue.wait():
+                        self._complete_track(future, *item)
+                ffpfile = state['ffp']
+                if engine == 'md5':
+                    queue.submit(get_device(ffpfile.location, st), (state,filenm,checksum,st,engine),
+                                 verifymd5file, filenm,checksum,ffpfile.name,ffpfile.location)
+                else:
+                    queue.submit(get_device(ffpfile.location, st), (state,filenm,checksum,st,engine),
+                                 verifyflacfile, filenm,checksum,ffpfile.flacpath,ffpfile.metaflacpath,ffpfile.name,ffpfile.location,engine)
+            for (item, future) in queue.drain():
+                self._complete_track(future, *item)
+
+    def _work_items(self, ffps):
+        """generate the (ffp state, track, checksum, stat, engine) items that need to be verified, handling cached tracks and empty ffps directly"""
+        for ffpfile in ffps:
+            if ffpfile.errors:
+                self._finish({'ffp': ffpfile, 'lines': [], 'remaining': 0}, verified = False)
+                continue
+            ffpfile.result = []
+            state = {'ffp': ffpfile, 'lines': [], 'remaining': 0}
+            pending = []
+            for (filenm,checksum) in list(ffpfile.signatures.items()):
+                if self.journal is not None:
+                    completed = self.journal.completed(ffpfile, filenm, checksum)
+                    if completed is not None:
+                        #verified before the run was interrupted, keep its result so the error summary covers both sessions
+                        self._add_result(state, filenm, checksum, 'resumed', None, *completed)
+                        continue
+                try:
+                    st = os.stat(ffpfile.location + '/' + filenm)
+                except OSError:
+                    st = None
+                engine = self.track_engine(ffpfile.location + '/' + filenm, ffpfile)
+                if self.cache is not None and engine != 'header':
+                    verified = self.cache.is_current(ffpfile.location + '/' + filenm, checksum, st) if st is not None else None
+                    if verified is not None:
+                        message = f"{filenm}:{checksum} passed (cached {verified:%Y-%m-%d %H:%M})."
+                        self._add_result(state, filenm, checksum, 'cached', engine, None, message)
+                        if self.journal is not None:
+                            self.journal.record(ffpfile, filenm, checksum, None, message)
+                        continue
+                pending.append((filenm,checksum,st,engine))
+            #read the tracks in directory/inode order to keep the disk from seeking back and forth
+            pending.sort(key=lambda x: location_key(ffpfile.location + '/' + x[0], x[2]) if x[2] is not None else ('', 0, x[0]))
+            state['remaining'] = len(pending)
+            if not pending:
+                self._finish(state)
+            for (filenm,checksum,st,engine) in pending:
+                yield (state,filenm,checksum,st,engine)
+
+    def track_engine(self, filepath, sigfile = None):
+        """engine used for a track, depends on the tier and the scrub slice. The files of an md5 file are always hashed whole, there is no header to check"""
+        if isinstance(sigfile, md5):
+            return 'md5'
+        if self.tier == 'fast' and not in_scrub_slice(filepath, self.scrub_days):
+            return 'header'
+        return self.engine
+
+    def _add_result(self, state, filenm, checksum, status, engine, Err, message):
+        """collect the result of a track on its ffp and pass it on to the sink and progress. status is passed, error, cached or resumed"""
+        status = 'error' if Err != None else status
+        if Err == None:
+            if self.keep_results:
+                state['ffp'].result.append(message)
+        else:
+            state['ffp'].errors.append(Err)
+        if not self.silent:
+            state['lines'].append('\t'+ message if Err == None else Err)
+        if self.sink is not None:
+            ffpfile = state['ffp']
+            self.sink.write(ffp = ffpfile.location + '/' + ffpfile.name, track = filenm, checksum = checksum, status = status, engine = engine, message = message)
+        if self.progress is not None:
+            self.progress.track(status)
+
+    def _complete_track(self, future, state, filenm, checksum, st, engine):
         try:
-            raw_audio_data = f.read(dtype='int16')
-            raw_audio_bytes = raw_audio_data.tobytes()
-            print("Sample rate:", f.samplerate)
-            print("Channels:", f.channels)
-            print("Frames:", f.frames)
-            print("Duration (s):", f.frames / f.samplerate)
-            #print("Extra info:" f.)
-            print("Fingerprint:", hashlib.md5(raw_audio_bytes).hexdigest())
-            #if 'extra_info' in sf.info(flac_file).:
-            extra_info = sf.info(flac_file).extra_info
-            #if extra_info:
-            print("Error information:", extra_info)                
+            Err,message = future.result()
         except Exception as e:
-            print(f"Error decoding FLAC file: {e}")
-    return hashlib.md5(raw_audio_bytes).hexdigest()
+            Err = message = f'Error verifying file: {filenm}:\n\t {e}'
+        self._add_result(state, filenm, checksum, 'passed', engine, Err, message)
+        if self.journal is not None:
+            self.journal.record(state['ffp'], filenm, checksum, Err, message)
+        #header only results are not recorded, the cache only holds full verifications
+        if self.cache is not None and st is not None and engine != 'header':
+            self.cache.record(state['ffp'].location + '/' + filenm, checksum, Err == None, message, st)
+        state['remaining'] -= 1
+        if state['remaining'] == 0:
+            self._finish(state)
+
+    def _finish(self, state, verified = True):
+        """all tracks of an ffp are done, output its results as one block"""
+        ffpfile = state['ffp']
+        if self.progress is not None:
+            self.progress.ffp_done()
+        if verified:
+            if self.cache is not None:
+                self.cache.commit()
+            if not self.silent:
+                print('\n'.join([f'Verifying {ffpfile.name} in {ffpfile.location}:'] + state['lines']))
+        if self.on_complete is not None:
+            self.on_complete(ffpfile)
 
 class albumfolder:
     """class to hold a directory containing flac files, equivalent to an album or a concert. in some cases the flac files may be located in sub directories divided by discs"""
@@ -305,46 +783,43 @@ class md5:
     def readmd5file(self):
         """split md5 file into dictionary with full file path as key and signature as value"""
         md5Name = f'{self.location}/{self.name}'
-        msg = None
-        md5_sigs = {}
-        try: 
-            md5 = open(md5Name, encoding="utf-8")
-        except Exception as e:
-            msg = f'Error reading file {md5Name}: {e}'
-            print(msg)
-            self.errors.append(msg)
-            #logger.error(msg)
-        #Attempt to read the first line of the ffp file to determine if it is not encoded using utf-8. If an error occurs, reopen without the encoding parameter.
-        try:
-            firstline = md5.readline()
-            md5.close()
-            md5 = open(md5Name, encoding="utf-8")
-        except UnicodeDecodeError:
-            md5.close()
-            try: 
-                md5 = open(md5Name)
-            except Exception as e:
-                msg = f'Error reading file {md5Name}: {e}'
-                self.errors.append(msg)
-                print(msg)
-                #logger.error(msg)               
         try:
-            for line in md5:
-                    if not line.startswith(';') and ':' in line:
-                        md5_line = line.strip().replace('\\','/')
-                        md5_parts = md5_line[::-1].split(':',1)
-                        md5_sigs[md5_parts[0][::-1]] = md5_parts[0][::-1]
-                    else:
-                        if not line.startswith(';') and '*' in line:
-                            md5_line = line.strip().replace('\\','/')
-                            md5_parts = md5_line[::-1].split('*',1)
-                            md5_sigs[md5_parts[0][::-1].strip()] = md5_parts[1][::-1].strip()
-                    print(md5_parts)
-            self.signatures = md5_sigs
+            self.signatures = read_signature_file(md5Name, 'md5')
         except Exception as e:
             msg = f'Error reading file {md5Name}: {e}'
-            #print(msg)
+            print(msg)
             self.errors.append(msg)
+
+    def verify(self, silent = False, max_workers = None, cache = None):
+        """verify an md5 file by hashing each listed file, see verifyscheduler. To verify many, pass them all to one verifyscheduler instead"""
+        self.errors = []
+        verifyscheduler(max_workers = max_workers, cache = cache, silent = silent).run([self])
+
+def hashfile(filepath: str, buffersize: int = HASH_BUFFER_SIZE):
+    """md5 of a whole file, read into one reused buffer without going through python's buffered io"""
+    md5hash = hashlib.md5()
+    buffer = bytearray(buffersize)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            md5hash.update(view[:size])
+    return md5hash.hexdigest()
+
+def verifymd5file(filenm,checksum,md5nm,loc):
+    """check an individual file listed in an md5 file"""
+    try:
+        filehash = hashfile(loc + '/' + filenm)
+    except Exception as e:
+        Error = msg = f'Error verifying file: {filenm}:\n\t {e}'
+        return Error, msg
+    if filehash == str(checksum).strip().lower():
+        return None, f"{filenm}:{checksum} passed."
+    Error = msg = f"Error in file: {md5nm}. Path: {filenm}:{checksum} does not match the file's MD5 {filehash}."
+    return Error, msg
+
 ##################################################################
 #FOLDER MANAGEMENT FUNCTIONS
 ##################################################################
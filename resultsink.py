@@ -0,0 +1,100 @@
+"""This module is not intended for execution. It contains a buffered writer for machine readable verification results and a console progress summary"""
+import csv
+import io
+import json
+import queue
+import threading
+import time
+
+RESULT_FIELDS = ('time', 'ffp', 'track', 'checksum', 'status', 'engine', 'message')
+SINK_FORMATS = ('jsonl', 'csv')
+
+
+class resultsink:
+    """
+    Write one record per verified track to a JSONL or CSV file.
+    Records are handed to a background thread through a queue and written in batches, so the verification threads never wait on the disk or the console.
+    """
+    def __init__ (self, path: str, format: str = None, batch_size: int = 1000, flush_seconds: float = 2):
+        self.path = path
+        self.format = format if format else path.rsplit('.', 1)[-1].lower()
+        if self.format not in SINK_FORMATS:
+            raise ValueError(f'Unknown result format: {self.format}. Expected one of {SINK_FORMATS}')
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.records = queue.Queue()
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        if self.format == 'csv':
+            self.file.write(','.join(RESULT_FIELDS) + '\r\n')
+        self.writer = threading.Thread(target=self._write_batches, daemon=True)
+        self.writer.start()
+
+    def write(self, **record):
+        """queue a record, see RESULT_FIELDS. time is filled in when not passed"""
+        record.setdefault('time', time.strftime('%Y-%m-%dT%H:%M:%S'))
+        self.records.put(record)
+
+    def close(self):
+        """write the remaining records and close the file"""
+        self.records.put(None)
+        self.writer.join()
+        self.file.close()
+
+    def _format(self, batch):
+        if self.format == 'jsonl':
+            return ''.join(json.dumps({k: record.get(k) for k in RESULT_FIELDS}, ensure_ascii=False) + '\n' for record in batch)
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for record in batch:
+            writer.writerow([record.get(k) for k in RESULT_FIELDS])
+        return out.getvalue()
+
+    def _write_batches(self):
+        batch = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                record = self.records.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                record = False
+            if record is None:
+                break
+            if record:
+                batch.append(record)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() - last_flush >= self.flush_seconds):
+                self.file.write(self._format(batch))
+                self.file.flush()
+                batch = []
+                last_flush = time.monotonic()
+        if batch:
+            self.file.write(self._format(batch))
+        self.file.flush()
+
+
+class progress:
+    """print a one line summary of the verification every few seconds instead of a line per file"""
+    def __init__ (self, interval: float = 10):
+        self.interval = interval
+        self.start = self.last = time.monotonic()
+        self.files = 0
+        self.errors = 0
+        self.skipped = 0
+        self.ffps = 0
+
+    def track(self, status: str):
+        self.files += 1
+        if status == 'error':
+            self.errors += 1
+        elif status in ('cached', 'resumed'):
+            self.skipped += 1
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def ffp_done(self):
+        self.ffps += 1
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        print(f'{self.files} files in {self.ffps} ffps checked, {self.errors} errors, {self.skipped} skipped, {self.files / elapsed:.1f} files/s')
@@ -0,0 +1,297 @@
+"""This module is not intended for execution. It contains a Shorten (.shn) decoder written in python/numpy, used instead of shorten.exe when [shn] decoder = "native" in config.toml
+The output is the same byte stream shorten -x writes: the verbatim chunks stored in the file (the original WAV header and any trailing chunks) with the decoded samples in between.
+Versions 1-3 of the format are supported with 8 bit unsigned and 16 bit signed samples, which covers the files written by shorten 2.x/3.x.
+"""
+import numpy as np
+
+SHORTEN_MAGIC = b'ajkg'
+SHORTEN_VERSIONS = (1, 2, 3)
+
+#field sizes (rice parameters) and defaults from the reference implementation
+ULONGSIZE = 2
+NSKIPSIZE = 1
+LPCQSIZE = 2
+LPCQUANT = 5
+XBYTESIZE = 7
+TYPESIZE = 4
+CHANSIZE = 0
+ENERGYSIZE = 3
+BITSHIFTSIZE = 2
+FNSIZE = 2
+VERBATIM_CKSIZE_SIZE = 5
+VERBATIM_BYTE_SIZE = 8
+NWRAP = 3
+DEFAULT_BLOCK_SIZE = 256
+V2LPCQOFFSET = 1 << LPCQUANT
+
+#block commands
+FN_DIFF0, FN_DIFF1, FN_DIFF2, FN_DIFF3, FN_QUIT, FN_BLOCKSIZE, FN_BITSHIFT, FN_QLPC, FN_ZERO, FN_VERBATIM = range(10)
+
+#sample types, dtype of the decoded samples and the value the running means start at
+TYPE_U8 = 2
+TYPE_S16HL = 3
+TYPE_S16LH = 5
+SAMPLE_TYPES = {TYPE_U8: (np.dtype('u1'), 0x80),
+                TYPE_S16HL: (np.dtype('>i2'), 0),
+                TYPE_S16LH: (np.dtype('<i2'), 0)}
+
+
+def cdiv(a: int, b: int):
+    """integer division truncating toward zero like C, the means are computed this way"""
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b > 0) else -q
+
+def undiff(residuals, history, order: int):
+    """
+    Samples predicted by the fixed polynomial of the given order (FN_DIFF1-3) from their residuals, history holds the preceding samples.
+    The predictor makes the order-th difference of the samples equal to the residuals, so they are rebuilt with order cumulative sums.
+    """
+    levels = []
+    h = np.asarray(history[len(history) - order:], dtype=np.int64)
+    for k in range(order):
+        levels.append(int(h[-1]))
+        h = np.diff(h)
+    x = residuals
+    for k in reversed(range(order)):
+        x = np.cumsum(x) + levels[k]
+    return x
+
+
+class bitreader:
+    """MSB first reader of the rice coded fields of a shorten file. A block of residuals is decoded with numpy, the occasional header fields bit by bit"""
+    def __init__ (self, data: bytes, pos: int = 0):
+        self.data = data
+        self.buffer = np.frombuffer(data, dtype=np.uint8)
+        self.pos = pos
+
+    def bits(self, n: int):
+        if n == 0:
+            return 0
+        start, end = self.pos >> 3, (self.pos + n + 7) >> 3
+        if end > len(self.data):
+            raise EOFError("Unexpected end of shorten stream")
+        value = int.from_bytes(self.data[start:end], 'big') >> (end * 8 - self.pos - n)
+        self.pos += n
+        return value & ((1 << n) - 1)
+
+    def unary(self):
+        """number of 0 bits before the next 1 bit, which is consumed"""
+        byte, bit = self.pos >> 3, self.pos & 7
+        try:
+            current = self.data[byte] & (0xff >> bit)
+            while current == 0:
+                byte += 1
+                current = self.data[byte]
+        except IndexError:
+            raise EOFError("Unexpected end of shorten stream") from None
+        end = byte * 8 + 8 - current.bit_length()
+        zeros = end - self.pos
+        self.pos = end + 1
+        return zeros
+
+    def uvar(self, k: int):
+        return (self.unary() << k) | self.bits(k)
+
+    def svar(self, k: int):
+        u = self.uvar(k + 1)
+        return ~(u >> 1) if u & 1 else u >> 1
+
+    def svar_block(self, n: int, k: int):
+        """
+        n signed rice codes with parameter k as an int64 array.
+        Where each code ends depends on the one before it, so only that chain is followed in python, one lookup per code. Splitting the codes into their parts is done with numpy.
+        """
+        nb = k + 1
+        startbyte = self.pos >> 3
+        length = (n * (nb + 2)) // 8 + 16
+        while True:
+            bits = np.unpackbits(self.buffer[startbyte:startbyte + length])
+            limit = len(bits)
+            #position of the next 1 bit at or after every bit, limit past the last one (padded so a chain that runs off the end can be detected afterwards)
+            nextone = np.where(bits, np.arange(limit), limit)
+            nextone = np.concatenate((np.minimum.accumulate(nextone[::-1])[::-1], np.full(nb + 2, limit))).tolist()
+            p = first = self.pos - startbyte * 8
+            step = nb + 1
+            ends = [0] * n
+            for i in range(n):
+                p = nextone[p] + step
+                ends[i] = p
+            if p <= limit:
+                break
+            if startbyte + length >= len(self.data):
+                raise EOFError("Unexpected end of shorten stream")
+            length *= 2
+        self.pos = startbyte * 8 + p
+        ends = np.array(ends, dtype=np.int64)
+        #the 1 bit ending the unary part is just before the mantissa
+        mantissas = ends - nb
+        starts = np.concatenate(([first], ends[:-1]))
+        u = (mantissas - 1 - starts) << nb
+        u |= bits[mantissas[:, None] + np.arange(nb)].astype(np.int64) @ (np.int64(1) << np.arange(nb - 1, -1, -1, dtype=np.int64))
+        return np.where(u & 1, ~(u >> 1), u >> 1)
+
+
+class shndecoder:
+    """
+    Decode a .shn file. chunks() generates the bytes shorten -x writes, pcm_blocks() only the samples as (frames, channels) arrays.
+    The whole file is read into memory, decoding is done a block at a time.
+    """
+    def __init__ (self, filepath: str):
+        self.filepath = filepath
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        if data[:4] != SHORTEN_MAGIC:
+            raise ValueError(f"Not a shorten file: {filepath}")
+        self.version = data[4]
+        if self.version not in SHORTEN_VERSIONS:
+            raise ValueError(f"Unsupported shorten version {self.version}: {filepath}")
+        self.reader = bitreader(data, 5 * 8)
+        self.ftype = self.ulong()
+        if self.ftype not in SAMPLE_TYPES:
+            raise ValueError(f"Unsupported shorten sample type {self.ftype}: {filepath}")
+        self.dtype, self.initial_mean = SAMPLE_TYPES[self.ftype]
+        self.channels = self.ulong()
+        self.blocksize = self.ulong()
+        self.maxnlpc = self.ulong()
+        self.nmean = self.ulong()
+        if not 0 < self.channels <= 8 or not 0 < self.blocksize <= 65535 or self.maxnlpc > 1024 or self.nmean > 32768:
+            raise ValueError(f"Invalid shorten header: {filepath}")
+        #bytes stored before the audio are written out first
+        self.skipped = bytes(self.reader.uvar(XBYTESIZE) for i in range(self.ulong()))
+        self.nwrap = max(NWRAP, self.maxnlpc)
+        self.lpcqoffset = V2LPCQOFFSET if self.version > 1 else 0
+
+    def ulong(self):
+        return self.reader.uvar(self.reader.uvar(ULONGSIZE))
+
+    def chunks(self):
+        """generate the decoded file as bytes, the same stream as shorten -x"""
+        if self.skipped:
+            yield self.skipped
+        for (kind, value) in self._decode():
+            yield value if kind == 'verbatim' else value.astype(self.dtype, copy=False).tobytes()
+
+    def pcm_blocks(self):
+        """generate the samples as int32 arrays of (frames, channels), the verbatim chunks (e.g. the WAV header) are left out"""
+        for (kind, value) in self._decode():
+            if kind == 'pcm':
+                yield value
+
+    def _decode(self):
+        """generate ('verbatim', bytes) and ('pcm', (frames, channels) array) in file order"""
+        reader = self.reader
+        history = [np.zeros(self.nwrap, dtype=np.int64) for ch in range(self.channels)]
+        offsets = [[self.initial_mean] * max(1, self.nmean) for ch in range(self.channels)]
+        bitshift = 0
+        channel = 0
+        decoded = []
+        while True:
+            cmd = reader.uvar(FNSIZE)
+            if cmd == FN_QUIT:
+                break
+            if cmd == FN_VERBATIM:
+                length = reader.uvar(VERBATIM_CKSIZE_SIZE)
+                yield 'verbatim', bytes(reader.uvar(VERBATIM_BYTE_SIZE) for i in range(length))
+                continue
+            if cmd == FN_BITSHIFT:
+                bitshift = reader.uvar(BITSHIFTSIZE)
+                if bitshift > 32:
+                    raise ValueError(f"Invalid bitshift {bitshift}: {self.filepath}")
+                continue
+            if cmd == FN_BLOCKSIZE:
+                self.blocksize = self.ulong()
+                if not 0 < self.blocksize <= 65535:
+                    raise ValueError(f"Invalid block size {self.blocksize}: {self.filepath}")
+                continue
+            if cmd not in (FN_DIFF0, FN_DIFF1, FN_DIFF2, FN_DIFF3, FN_QLPC, FN_ZERO):
+                raise ValueError(f"Invalid shorten command {cmd}: {self.filepath}")
+            blocksize = self.blocksize
+            offset = offsets[channel]
+            #the mean of the last nmean blocks is the prediction offset
+            if self.nmean == 0:
+                coffset = offset[0]
+            else:
+                coffset = cdiv((self.nmean // 2 if self.version >= 2 else 0) + sum(offset), self.nmean)
+                if self.version >= 2 and bitshift:
+                    coffset = coffset >> (bitshift - 1) >> 1
+            hist = history[channel]
+            if cmd == FN_ZERO:
+                x = np.zeros(blocksize, dtype=np.int64)
+            else:
+                energy = reader.uvar(ENERGYSIZE)
+                if cmd == FN_QLPC:
+                    x = self._qlpc(energy, hist, coffset, blocksize)
+                else:
+                    residuals = reader.svar_block(blocksize, energy)
+                    x = residuals + coffset if cmd == FN_DIFF0 else undiff(residuals, hist, cmd)
+            if self.nmean > 0:
+                total = (blocksize // 2 if self.version >= 2 else 0) + int(x.sum())
+                del offset[0]
+                if self.version < 2:
+                    offset.append(cdiv(total, blocksize))
+                else:
+                    offset.append(0 if bitshift == 32 else cdiv(total, blocksize) << bitshift)
+            history[channel] = np.concatenate((hist, x))[-self.nwrap:]
+            #put back the low order zero bits the encoder removed
+            decoded.append(np.zeros_like(x) if bitshift == 32 else x << bitshift)
+            channel += 1
+            if channel == self.channels:
+                if any(len(block) != len(decoded[0]) for block in decoded):
+                    raise ValueError(f"Block size changed within a frame: {self.filepath}")
+                yield 'pcm', np.stack(decoded, axis=1).astype(np.int32)
+                channel = 0
+                decoded = []
+
+    def _qlpc(self, energy: int, hist, coffset: int, blocksize: int):
+        """
+        decode a block predicted by its own quantized LPC coefficients (FN_QLPC). The prediction floors after each sample, so this runs sample by sample in python.
+        shorten's default is not to use LPC, so few files have these blocks.
+        """
+        reader = self.reader
+        order = reader.uvar(LPCQSIZE)
+        if order > self.nwrap:
+            raise ValueError(f"Invalid LPC order {order}: {self.filepath}")
+        coefs = [reader.svar(LPCQUANT) for i in range(order)]
+        residuals = reader.svar_block(blocksize, energy).tolist()
+        #the prediction works on samples with the offset removed, history included
+        if order:
+            hist[len(hist) - order:] -= coffset
+        y = [int(v) for v in hist[len(hist) - order:]] if order else []
+        for r in residuals:
+            total = self.lpcqoffset
+            for j in range(order):
+                total += coefs[j] * y[-1 - j]
+            y.append(r + (total >> LPCQUANT))
+        return np.array(y[order:], dtype=np.int64) + coffset
+
+
+class shnstream:
+    """read-only binary file object over the output of shndecoder.chunks(), so it can be used wherever shorten -x's stdout was read"""
+    def __init__ (self, filepath: str):
+        self.chunks = shndecoder(filepath).chunks()
+        self.pending = b''
+
+    def read(self, size: int = -1):
+        parts = [self.pending]
+        available = len(self.pending)
+        while size < 0 or available < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        data = b''.join(parts)
+        if size < 0 or len(data) <= size:
+            self.pending = b''
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+    def close(self):
+        self.chunks.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, *exc):
+        self.close()
@@ -4,10 +4,12 @@ import sys
 import os
 import subprocess
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from filefolder_org import get_files_by_extension,copy_files_by_extension_recursive,get_file_extensions
-from losslessfiles import generate_st5_for_folder
+from losslessfiles import st5_records_for_files,write_st5_file,read_streaminfo,teestream,wav_data_md5,READ_BUFFER_SIZE,ShnDecoder,ShnCrossCheck,shnstream
+from signaturefiles import read_signature_records
+from convertmanifest import convertmanifest
 
 # For Python 3.11+, 'import tomllib' is built in.
 # For older Pythons: 'pip install tomli' => 'import tomli as tomllib'
@@ -16,18 +18,29 @@ import tomllib
 Usage:
   python shn_to_flac_compare_st5.py <source_parent> <destination_parent>
 
-What it does:
-  1) For each folder with .shn in <source_parent>:
-     - Generate an ST5 for the .shn using "shntool.exe hash -m *.shn > folderName.shn.st5"
-  2) Multi-threaded .shn -> .flac conversion, placing .flac in a renamed folder under <destination_parent>.
+What it does (a folder moves on to 2-5 as soon as its own tracks are converted,
+while the conversion of the next folders continues):
+  1) Multi-threaded .shn -> .flac conversion, placing .flac in a renamed folder under <destination_parent>.
      - If ".shnf" is in the folder name, replace it with ".flac16"
        else append ".flac16"
+     shorten.exe -x is piped into flac.exe, no .wav is written to disk.
+     Each .flac is written as ".flac.part" and renamed once verified. Completed
+     tracks are recorded in "conversion_manifest.jsonl" in <destination_parent>,
+     so running the same batch again only converts the tracks that did not finish.
+     One track per available core is converted at once, see [convert] workers.
+  2) For each folder with .shn in <source_parent>:
+     - Write an ST5 for the .shn, "folderName.shn.st5", from the WAV data MD5 taken
+       while the decoded audio was passed to flac.exe (the same lines as
+       "shntool.exe hash -m *.shn"). Tracks not converted in this run are hashed separately.
+       With [shn] decoder = "native" and [shn] crosscheck = true every .shn is hashed again by
+       shntool/shorten, so the .flac is checked against a decoder independent of the one that made it.
   3) Copies any .txt files from source folder to the target folder
-  4) Generate ST5 from the new .flac in the target folder using
-     "shntool.exe hash -m *.flac > folderName.flac.st5"
-  5) Compare the two ST5 files line-by-line (the .shn ST5 from source,
-     the .flac ST5 in target) and append the results to "verification.log"
-     in the root of <destination_parent>.
+  4) Generate ST5 from the new .flac in the target folder, "folderName.flac.st5",
+     from the STREAMINFO MD5 of each file instead of decoding it again, see flac_st5_records
+  5) Compare the two ST5 files track by track, pairing tracks by file name
+     without extension (the .shn ST5 from source, the .flac ST5 in target),
+     and append the results to "verification.log" in the root of
+     <destination_parent>.
 
 Requirements:
   - Python 3.11+ or 'pip install tomli' for older Pythons
@@ -37,11 +50,23 @@ Requirements:
       flac    = "L:/Flac/flac.exe"
       shntool = "L:/Flac/shntool.exe"
   - shorten.exe, flac.exe, shntool.exe must be valid executables.
+    shorten is not needed with [shn] decoder = "native", which decodes the .shn in-process.
+    shntool is not needed with [st5] engine = "native", which writes the same st5 lines in-process.
 """
 
 
 
 
+# folders whose ST5s are written and compared at once, alongside the conversions
+FINISH_WORKERS = 2
+
+# a .flac is encoded to this name next to it and renamed once verified
+TEMP_SUFFIX = ".part"
+
+# completed conversions of the batch, in the root of <destination_parent>
+MANIFEST_NAME = "conversion_manifest.jsonl"
+
+
 ###############################################################################
 # Folder Name Transformation
 ###############################################################################
@@ -84,25 +109,101 @@ def parse_config(config_path: str):
     return shorten_exe, flac_exe, shntool_exe
 
 
+def available_cores() -> int:
+    """Number of cores this process may run on, respecting CPU affinity where the OS reports it."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def parse_convert_workers(config_path: str) -> int:
+    """
+    Reads [convert] workers from config.toml => number of tracks converted at once.
+    0 or missing => one per available core, each conversion keeps about one core
+    busy (flac encoding and verifying, with shorten decoding alongside).
+    """
+    with open(config_path, "rb") as f:
+        config = tomllib.load(f)
+    workers = config.get("convert", {}).get("workers", 0)
+    return workers if workers else available_cores()
+
+
 ###############################################################################
-# SHN -> WAV -> FLAC
+# SHN -> FLAC
 ###############################################################################
 
-def decode_shn_to_wav(shorten_exe: str, shn_path: str, wav_path: str):
-    """Decode .shn => .wav (shorten.exe -x)."""
-    cmd = [shorten_exe, "-x", shn_path, wav_path]
-    subprocess.run(cmd, check=True)
-
-def encode_wav_to_flac(flac_exe: str, wav_path: str, flac_path: str):
-    """Encode .wav => .flac (flac.exe wav_path -o flac_path)."""
-    cmd = [flac_exe, wav_path, "-o", flac_path]
-    subprocess.run(cmd, check=True)
+def pipe_shn_to_flac(shorten_exe: str, flac_exe: str, shn_path: str, flac_path: str) -> str:
+    """
+    Decode .shn => .flac without a .wav on disk: shorten.exe -x writes the WAV
+    stream to stdout, which is passed on to flac.exe reading from stdin.
+    With [shn] decoder = "native" the WAV stream comes from shndecoder instead.
+    The WAV data is hashed on the way through, which is the MD5 that
+    "shntool hash -m" reports for the .shn, and returned.
+    flac.exe --verify decodes the frames it writes and checks them against its input.
+    Raises CalledProcessError if either process fails.
+    """
+    decode_cmd = [shorten_exe, "-x", shn_path, "-"]
+    encode_cmd = [flac_exe, "--verify", "-", "-o", flac_path]
+    if ShnDecoder == "native":
+        if shnstream is None:
+            raise Exception("The native shn decoder requires numpy to be installed")
+        decoder = None
+        source = shnstream(shn_path)
+    else:
+        decoder = subprocess.Popen(decode_cmd, stdout=subprocess.PIPE)
+        source = decoder.stdout
+    try:
+        encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE)
+    except OSError:
+        if decoder is not None:
+            decoder.kill()
+            decoder.wait()
+        source.close()
+        raise
+    md5 = None
+    error = None
+    try:
+        tee = teestream(source, encoder.stdin)
+        md5 = wav_data_md5(tee)
+        # anything after the data chunk is passed on as is
+        while tee.read(READ_BUFFER_SIZE):
+            pass
+    except BrokenPipeError:
+        # flac exited early, reported with its return code below
+        pass
+    except Exception as e:
+        error = e
+        if decoder is not None:
+            decoder.kill()
+    finally:
+        source.close()
+        try:
+            encoder.stdin.close()
+        except BrokenPipeError:
+            pass
+    encoder.wait()
+    if decoder is not None:
+        decoder.wait()
+        if decoder.returncode != 0:
+            raise subprocess.CalledProcessError(decoder.returncode, decode_cmd)
+    if error is not None:
+        raise error
+    if encoder.returncode != 0:
+        raise subprocess.CalledProcessError(encoder.returncode, encode_cmd)
+    return md5
 
 def convert_one_shn_file(shorten_exe, flac_exe, source_parent, dest_parent,
-                         src_folder, shn_filename):
+                         src_folder, shn_filename, manifest=None):
     """
     Convert one .shn => .flac in the renamed folder under <dest_parent>.
-    Return True on success, False otherwise.
+    The .flac is written under a temporary name and only renamed into place once
+    flac has verified it and its STREAMINFO MD5 matches the hash of the .shn audio,
+    so a run that is killed never leaves a partial .flac behind.
+    With a manifest, tracks it records as complete are skipped and every new
+    .flac is recorded. Without one, any existing .flac is skipped.
+    Return (True, md5) on success, md5 is the WAV data MD5 of the .shn or None
+    if the .flac already existed. Return (False, None) otherwise.
     """
     shn_path = os.path.join(src_folder, shn_filename)
 
@@ -113,31 +214,44 @@ def convert_one_shn_file(shorten_exe, flac_exe, source_parent, dest_parent,
 
     base_name = os.path.splitext(shn_filename)[0]
     flac_path = os.path.join(out_dir, base_name + ".flac")
-
-    # if flac already exists => skip
-    if os.path.exists(flac_path):
+    temp_path = flac_path + TEMP_SUFFIX
+
+    # completed in an earlier run => skip
+    if manifest is not None:
+        md5 = manifest.completed(shn_path, flac_path)
+        if md5:
+            print(f"[SKIP] Converted in an earlier run => {flac_path}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return True, md5
+    elif os.path.exists(flac_path):
         print(f"[SKIP] FLAC exists => {flac_path}")
-        return True
-
-    wav_path = os.path.join(out_dir, base_name + ".wav")
+        return True, None
 
-    print(f"\n[THREAD] Converting:\n  SHN : {shn_path}\n  WAV : {wav_path}\n  FLAC: {flac_path}")
+    print(f"\n[THREAD] Converting:\n  SHN : {shn_path}\n  FLAC: {flac_path}")
 
-    # decode
+    # decode and encode through a pipe, into the temporary name
     try:
-        decode_shn_to_wav(shorten_exe, shn_path, wav_path)
-        # encode
-        encode_wav_to_flac(flac_exe, wav_path, flac_path)
-    except subprocess.CalledProcessError as e:
+        # left over by an interrupted run
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        md5 = pipe_shn_to_flac(shorten_exe, flac_exe, shn_path, temp_path)
+        info = read_streaminfo(temp_path)
+        # 8 bit is hashed signed by flac, unsigned in the WAV data, see flac_st5_records
+        if info["bits_per_sample"] != 8 and info["md5"] != md5:
+            raise Exception(f"STREAMINFO MD5 {info['md5']} differs from the .shn audio MD5 {md5}")
+        with open(temp_path, "r+b") as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, flac_path)
+    except Exception as e:
         print(f"Error converting {shn_path}: {e}")
-        if os.path.exists(flac_path):
-            os.remove(flac_path)
-        return False
-    finally:
-        if os.path.exists(wav_path):
-            os.remove(wav_path)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False, None
 
-    return True
+    if manifest is not None:
+        manifest.record(shn_path, flac_path, md5)
+    return True, md5
 
 
 ###############################################################################
@@ -161,87 +275,187 @@ def gather_shn_files_by_folder(source_parent):
 ###############################################################################
 
 
-def compare_st5_files(st5_shn_path: str, st5_flac_path: str) -> list[str]:
+def flac_st5_records(shntool_exe: str, folder: str, flac_files: list):
     """
-    Compares wave-based MD5 lines from shn vs flac ST5 files, returning a list of
-    result strings. For lines with matching MD5, logs a single-line "MATCH" entry.
-    For differences or errors, logs a multi-line entry with details.
+    (file, md5) ST5 records of the .flac files in 'folder', returns (records, returncode).
+    flac stores the MD5 of the audio it encoded in the STREAMINFO. For 16 and 24 bit
+    that is the WAV data MD5 shntool reports, so the header is read instead of
+    decoding the file again. 8 bit files (flac hashes the samples signed, a WAV
+    stores them unsigned) and files whose header can't be read are hashed in full.
+    """
+    records = []
+    rehash = []
+    for fname in flac_files:
+        try:
+            info = read_streaminfo(os.path.join(folder, fname))
+        except Exception:
+            info = None
+        if info is None or info["bits_per_sample"] == 8 or info["md5"] == "0" * 32:
+            rehash.append(fname)
+        else:
+            records.append((fname, info["md5"]))
+    returncode = 0
+    if rehash:
+        rehashed, returncode = st5_records_for_files(shntool_exe, folder, rehash)
+        records += rehashed
+    return sorted(records), returncode
 
-    Example ST5 line format from shntool:
-      b8e748d6698bfe2847ebddee6d77633d  [shntool]  gd66-01t01.shn
+
+def st5_track_key(fname: str) -> str:
     """
+    Key used to pair the tracks of two ST5 files: the file name without folder or
+    extension, case-folded, so gd66-01t01.shn and gd66-01t01.flac are the same track.
+    """
+    return os.path.splitext(os.path.basename(fname.replace("\\", "/")))[0].casefold()
 
 
-    
+def compare_st5_records(shn_records: list, flac_records: list) -> list[str]:
+    """
+    Compares wave-based MD5s of the .shn and .flac tracks, given as the (file, md5)
+    records from generate_st5_for_folder or flac_st5_records, returning a list of result strings.
+    Tracks are paired by st5_track_key, so a missing or reordered track only affects
+    itself. Matching tracks get a single-line "MATCH" entry; mismatches, tracks
+    missing from the FLAC side and extra FLAC tracks get a multi-line entry.
+    """
     results = []
+    flac_by_key = {st5_track_key(fname): (fname, md5) for (fname, md5) in flac_records}
+    seen = set()
 
-    # Check files
-    if not os.path.isfile(st5_shn_path):
-        results.append(f"[ERROR] Missing SHN ST5 file: {st5_shn_path}")
-        return results
-    if not os.path.isfile(st5_flac_path):
-        results.append(f"[ERROR] Missing FLAC ST5 file: {st5_flac_path}")
-        return results
-
-    # Read lines
-    with open(st5_shn_path, "r", encoding="utf-8") as f:
-        shn_lines = [line.strip() for line in f if line.strip()]
-    with open(st5_flac_path, "r", encoding="utf-8") as f:
-        flac_lines = [line.strip() for line in f if line.strip()]
-
-    max_len = max(len(shn_lines), len(flac_lines))
-
-    def parse_st5_line(line: str):
-        """
-        Splits ST5 line into (md5, filename).
-        Example:
-          "b8e748d6698bfe2847ebddee6d77633d  [shntool]  gd66-01t01.shn"
-        => md5="b8e748d6698bfe2847ebddee6d77633d", filename="gd66-01t01.shn"
-        """
-        tokens = line.split(None, 2)
-        if len(tokens) == 0:
-            return ("", "")
-        if len(tokens) == 1:
-            return (tokens[0], "")
-        if len(tokens) == 2:
-            return (tokens[0], tokens[1])
-        # tokens[2] presumably the filename
-        md5 = tokens[0]
-        filename = tokens[2]
-        return (md5, filename)
-
-    for i in range(max_len):
-        shn_line = shn_lines[i] if i < len(shn_lines) else "[no line]"
-        flac_line = flac_lines[i] if i < len(flac_lines) else "[no line]"
-
-        shn_md5, shn_fname = parse_st5_line(shn_line)
-        flac_md5, flac_fname = parse_st5_line(flac_line)
-
-        # If either MD5 is missing, that's a difference
-        if not shn_md5 or not flac_md5:
+    for (shn_fname, shn_md5) in shn_records:
+        key = st5_track_key(shn_fname)
+        seen.add(key)
+        if key not in flac_by_key:
             results.append(
-                f"Line {i+1} differs:\n"
-                f"  SHN line : {shn_line}\n"
-                f"  FLAC line: {flac_line}\n"
+                f"Missing FLAC for {shn_fname}:\n"
+                f"  SHN => {shn_md5}  {shn_fname}\n"
             )
             continue
-
+        flac_fname, flac_md5 = flac_by_key[key]
         if shn_md5 == flac_md5:
             # Single-line match log
             results.append(
-                f"Line {i+1} MATCH: MD5={shn_md5} | SHN={shn_fname} | FLAC={flac_fname}"
+                f"MATCH: MD5={shn_md5} | SHN={shn_fname} | FLAC={flac_fname}"
             )
         else:
             # Multi-line difference
             results.append(
-                f"Line {i+1} differs:\n"
+                f"{shn_fname} differs:\n"
                 f"  SHN => {shn_md5}  {shn_fname}\n"
                 f"  FLAC => {flac_md5} {flac_fname}\n"
             )
 
+    for (flac_fname, flac_md5) in flac_records:
+        if st5_track_key(flac_fname) not in seen:
+            results.append(
+                f"Extra FLAC without SHN:\n"
+                f"  FLAC => {flac_md5} {flac_fname}\n"
+            )
+
     return results
 
 
+def compare_st5_files(st5_shn_path: str, st5_flac_path: str) -> list[str]:
+    """
+    Compares wave-based MD5 lines from shn vs flac ST5 files on disk, see
+    compare_st5_records.
+
+    Example ST5 line format from shntool:
+      b8e748d6698bfe2847ebddee6d77633d  [shntool]  gd66-01t01.shn
+    """
+    # Check files
+    if not os.path.isfile(st5_shn_path):
+        return [f"[ERROR] Missing SHN ST5 file: {st5_shn_path}"]
+    if not os.path.isfile(st5_flac_path):
+        return [f"[ERROR] Missing FLAC ST5 file: {st5_flac_path}"]
+
+    return compare_st5_records(read_signature_records(st5_shn_path, 'st5'),
+                               read_signature_records(st5_flac_path, 'st5'))
+
+
+
+def finish_folder(shntool_exe: str, source_parent: str, dest_parent: str,
+                  folder: str, shn_files: list, hashes: dict) -> list[str]:
+    """
+    Everything that happens to a folder after its tracks are converted:
+      - write the .shn ST5 in the source folder from the conversion hashes
+      - copy the other files to the target folder
+      - write the .flac ST5 in the target folder from the STREAMINFO MD5s
+      - compare the two
+    With [shn] decoder = "native" the conversion hashes come from the same decoded
+    audio that was encoded. With [shn] crosscheck = true as well, the .shn ST5 is made
+    with shntool (or shorten for [st5] engine = "native") instead, and any track where
+    the native decoder disagrees with it is logged.
+    Returns the lines for verification.log, empty if there is no target folder.
+    """
+    # ST5 for the .shn in the source folder
+    folder_name = os.path.basename(folder)
+    st5_path = os.path.join(folder, folder_name + ".shn.st5")
+    decoder_diffs = []
+    crosscheck = ShnDecoder == "native" and ShnCrossCheck
+    if crosscheck:
+        # independent of the native decoder
+        shn_records, rc = st5_records_for_files(shntool_exe, folder, shn_files, shn_decoder="shorten")
+        if rc != 0:
+            print(f"[ST5 WARN] Return code {rc} for .shn st5 in {folder}")
+        for (fn, md5) in shn_records:
+            if fn in hashes and hashes[fn] != md5:
+                decoder_diffs.append(
+                    f"Native decoder differs from shorten for {fn}:\n"
+                    f"  native  => {hashes[fn]}\n"
+                    f"  shorten => {md5}\n"
+                )
+    else:
+        shn_records = [(fn, hashes[fn]) for fn in shn_files if fn in hashes]
+        # skipped or failed conversions were not hashed
+        missing = [fn for fn in shn_files if fn not in hashes]
+        if missing:
+            records, rc = st5_records_for_files(shntool_exe, folder, missing)
+            shn_records += records
+            if rc != 0:
+                print(f"[ST5 WARN] Return code {rc} for .shn st5 in {folder}")
+    print(f"[ST5 from: {folder} => {os.path.basename(st5_path)}]")
+    write_st5_file(st5_path, shn_records)
+    shn_records = sorted(shn_records)
+
+    # The renamed target folder
+    rel_transformed = transform_subfolder_name(source_parent, folder)
+    tgt_folder = os.path.join(dest_parent, rel_transformed)
+    if not os.path.isdir(tgt_folder):
+        return []
+
+    # Copy any files that are in the original folder
+    extension_list = get_file_extensions(folder)
+    exclude_extensions = [".shn",".md5"]
+    for extension in extension_list:
+        if extension.lower() in exclude_extensions:
+            #don't want to copy these
+            continue
+        copy_files_by_extension_recursive(folder,tgt_folder,extension)
+
+    # ST5 for .flac in target from the STREAMINFO MD5s
+    folder_name = os.path.basename(tgt_folder)
+    st5_flac_path = os.path.join(tgt_folder, folder_name + ".flac.st5")
+    flac_files = get_files_by_extension(tgt_folder,'flac')
+    print(f"[ST5 from: {tgt_folder} => {os.path.basename(st5_flac_path)}]")
+    flac_records, rc2 = flac_st5_records(shntool_exe, tgt_folder, flac_files)
+    write_st5_file(st5_flac_path, flac_records)
+    if rc2 != 0:
+        print(f"[ST5 WARN] Return code {rc2} for .flac st5 in {tgt_folder}")
+
+    # Compare with the .shn st5 records, both sides are already in memory
+    lines = [f"\n--- Comparing .shn ST5 vs .flac ST5 for folder: {folder}"]
+    if not shn_records and crosscheck:
+        lines.append("[ERROR] No .shn ST5 from shntool/shorten, the native decoder output was not checked.")
+    elif not shn_records:
+        lines.append("[SKIP] No .shn ST5 found.")
+    else:
+        diffs = decoder_diffs + compare_st5_records(shn_records, flac_records)
+        if diffs:
+            lines += diffs
+        else:
+            lines.append("[OK] No differences.")
+    return lines
+
 
 ###############################################################################
 # MAIN
@@ -277,23 +491,27 @@ def main():
         print("No .shn files found, exiting.")
         return
 
-    # 1) Generate ST5 from .shn in each source folder
-    st5_shn_map = {}  # folder => path to .shn st5
-    for folder, shn_files in shn_dict.items():
-        folder_name = os.path.basename(folder)
-        st5_filename = folder_name + ".shn.st5"
-        st5_path, rc = generate_st5_for_folder(shntool_exe, folder, st5_filename,shn_files)
-        st5_shn_map[folder] = st5_path
-        if rc != 0:
-            print(f"[ST5 WARN] Return code {rc} for .shn st5 in {folder}")
-
-    # 2) Multi-threaded conversion
-    futures = []
+    # 1) Multi-threaded conversion, hashing the decoded .shn audio on its way to flac
+    # 2) As soon as the last track of a folder is converted, its ST5s are written and
+    #    compared while the next folders are still converting
     success_count = 0
     fail_count    = 0
-    max_workers   = 3
+    max_workers   = parse_convert_workers(config_path)
+    shn_hashes    = {}  # folder => {shn filename: WAV data md5}
+    remaining     = {folder: len(shn_files) for folder, shn_files in shn_dict.items()}
+    print(f"Converting with {max_workers} workers")
+
+    os.makedirs(dest_parent, exist_ok=True)
+    verification_log = os.path.join(dest_parent, "verification.log")
+    with open(verification_log, "a", encoding="utf-8") as lf:
+        lf.write("\n====== FLAC vs SHN ST5 Comparison ======\n")
+    manifest = convertmanifest(os.path.join(dest_parent, MANIFEST_NAME))
+    print(f"Resuming from {manifest.path}, {len(manifest.entries)} tracks recorded" if manifest.entries
+          else f"Recording completed tracks in {manifest.path}")
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+         ThreadPoolExecutor(max_workers=FINISH_WORKERS) as finisher:
+        conversions = {}  # future => (folder, shn filename)
         for folder, shn_files in shn_dict.items():
             for shn_fn in shn_files:
                 fut = executor.submit(
@@ -303,68 +521,56 @@ def main():
                     source_parent,
                     dest_parent,
                     folder,
-                    shn_fn
+                    shn_fn,
+                    manifest
                 )
-                futures.append((folder, shn_fn, fut))
-
-        for (folder, shn_fn, fut) in futures:
-            try:
-                ok = fut.result()
-                if ok:
-                    success_count += 1
-                else:
+                conversions[fut] = (folder, shn_fn)
+
+        finishing = {}  # future => folder
+        pending = set(conversions)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut in finishing:
+                    folder = finishing.pop(fut)
+                    try:
+                        lines = fut.result()
+                    except Exception as ex:
+                        lines = [f"\n--- Comparing .shn ST5 vs .flac ST5 for folder: {folder}",
+                                 f"[ERROR] {ex}"]
+                    with open(verification_log, "a", encoding="utf-8") as lf:
+                        for line in lines:
+                            lf.write(line + "\n")
+                    continue
+
+                folder, shn_fn = conversions[fut]
+                try:
+                    ok, md5 = fut.result()
+                    if ok:
+                        success_count += 1
+                        if md5:
+                            shn_hashes.setdefault(folder, {})[shn_fn] = md5
+                    else:
+                        fail_count += 1
+                except Exception as ex:
+                    print(f"[THREAD ERROR] {folder}/{shn_fn}: {ex}")
                     fail_count += 1
-            except Exception as ex:
-                print(f"[THREAD ERROR] {folder}/{shn_fn}: {ex}")
-                fail_count += 1
+                remaining[folder] -= 1
+                if remaining[folder] == 0:
+                    fin = finisher.submit(
+                        finish_folder,
+                        shntool_exe,
+                        source_parent,
+                        dest_parent,
+                        folder,
+                        shn_dict[folder],
+                        shn_hashes.get(folder, {})
+                    )
+                    finishing[fin] = folder
+                    pending.add(fin)
+    manifest.close()
 
     print(f"\n[RESULTS] SHN->FLAC done. success={success_count}, fail={fail_count}")
-
-    # 3) Copy .txt, generate ST5 for .flac in target, compare with .shn ST5
-    verification_log = os.path.join(dest_parent, "verification.log")
-    with open(verification_log, "a", encoding="utf-8") as lf:
-        lf.write("\n====== FLAC vs SHN ST5 Comparison ======\n")
-
-    for folder in shn_dict.keys():
-        # The renamed target folder
-        rel_transformed = transform_subfolder_name(source_parent, folder)
-        tgt_folder = os.path.join(dest_parent, rel_transformed)
-        if not os.path.isdir(tgt_folder):
-            continue
-
-        # Copy any files that are in the original folder
-        extension_list = get_file_extensions(folder)
-        exclude_extensions = [".shn",".md5"]
-        for extension in extension_list:
-            if extension.lower() in exclude_extensions:
-                #don't want to copy these
-                continue
-            copy_files_by_extension_recursive(folder,tgt_folder,extension)
-
-        # 3a) Generate ST5 for .flac in target
-        folder_name = os.path.basename(tgt_folder)
-        st5_flac_filename = folder_name + ".flac.st5"
-        flac_files = get_files_by_extension(tgt_folder,'flac')
-        st5_flac_path, rc2 = generate_st5_for_folder(shntool_exe, tgt_folder,st5_flac_filename, flac_files)
-        if rc2 != 0:
-            print(f"[ST5 WARN] Return code {rc2} for .flac st5 in {tgt_folder}")
-
-        # 3b) Compare with the .shn st5 if it exists
-        st5_shn_path = st5_shn_map.get(folder)  # path to the .shn st5 in source
-        with open(verification_log, "a", encoding="utf-8") as lf:
-            lf.write(f"\n--- Comparing .shn ST5 vs .flac ST5 for folder: {folder}\n")
-            if not st5_shn_path or not os.path.isfile(st5_shn_path):
-                lf.write("[SKIP] No .shn ST5 found.\n")
-            elif not os.path.isfile(st5_flac_path):
-                lf.write("[SKIP] .flac ST5 not found.\n")
-            else:
-                diffs = compare_st5_files(st5_shn_path, st5_flac_path)
-                if diffs:
-                    for d in diffs:
-                        lf.write(d + "\n")
-                else:
-                    lf.write("[OK] No differences.\n")
-
     print(f"\nAll done. Full verification => {verification_log}")
 
 
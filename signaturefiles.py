@@ -0,0 +1,79 @@
+"""This module is not intended for execution. It contains the parser shared by all signature files (.ffp, .md5, .st5 and .sfv)
+Each file is read once as bytes, the encoding is detected from the bytes, and the lines are parsed according to the file type.
+"""
+import os
+import re
+import codecs
+import locale
+
+SIGNATURE_KINDS = ('ffp', 'md5', 'st5', 'sfv')
+
+#"md5  file", "md5 *file" (md5sum) and "md5  [shntool]  file" (shntool hash -m)
+SPACED_LINE = re.compile(r'^([0-9a-fA-F]{32})\s+(?:\[shntool\]\s+)?\*?(.+)$')
+#"file crc32" (sfv)
+SFV_LINE = re.compile(r'^(.+?)\s+([0-9a-fA-F]{8})$')
+
+_BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+
+def signature_kind(name: str):
+    """signature file type from its extension, files with an unknown extension are parsed as ffp"""
+    kind = os.path.splitext(name)[1].lower().lstrip('.')
+    return kind if kind in SIGNATURE_KINDS else 'ffp'
+
+def decode_signature_bytes(data: bytes):
+    """
+    Decode the contents of a signature file: a BOM decides the encoding, otherwise utf-8 is tried,
+    then the system code page (what older tools on the same machine wrote), then latin-1 which accepts any byte.
+    """
+    for bom, encoding in _BOMS:
+        if data.startswith(bom):
+            return data.decode(encoding)
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+    try:
+        return data.decode(locale.getpreferredencoding(False))
+    except (UnicodeDecodeError, LookupError):
+        return data.decode('latin-1')
+
+def parse_signature_lines(text: str, kind: str = 'ffp'):
+    """generate (track, signature) in file order, comment and unparseable lines are skipped. paths use '/' as the separator"""
+    for line in text.splitlines():
+        line = line.strip()
+        #';' marks a comment in every kind. '#' only in .md5 files, an ffp or sfv line starts with the track name and a track may be called "#1 intro.flac"
+        if not line or line[0] == ';' or (kind == 'md5' and line[0] == '#'):
+            continue
+        if kind == 'sfv':
+            match = SFV_LINE.match(line)
+            if match:
+                yield match.group(1).replace('\\', '/'), match.group(2).lower()
+            continue
+        if kind == 'ffp':
+            #"file:md5", split on the last ':' as file names may contain one
+            track, sep, signature = line.rpartition(':')
+            if sep:
+                yield track.replace('\\', '/'), signature
+                continue
+            #old format seen in some files, "md5 *file"
+            signature, sep, track = line.rpartition('*')
+            if sep:
+                yield track.strip().replace('\\', '/'), signature.strip()
+                continue
+        match = SPACED_LINE.match(line)
+        if match:
+            yield match.group(2).replace('\\', '/'), match.group(1).lower()
+        elif kind == 'md5' and ':' in line:
+            track, sep, signature = line.rpartition(':')
+            yield track.replace('\\', '/'), signature.strip().lower()
+
+def read_signature_records(path: str, kind: str = None):
+    """read a signature file once and return its (track, signature) records in file order"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return list(parse_signature_lines(decode_signature_bytes(data), kind if kind else signature_kind(path)))
+
+def read_signature_file(path: str, kind: str = None):
+    """read a signature file once and return {track: signature}, a track listed twice keeps its last signature"""
+    return dict(read_signature_records(path, kind))
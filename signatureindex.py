@@ -0,0 +1,172 @@
+"""This script maintains a library-wide index of the signatures in all .ffp, .st5 and .md5 files, and answers lookups against it
+Usage:
+python signatureindex.py refresh <directory>      add new/changed signature files under directory, drop the ones that were deleted
+python signatureindex.py find <md5>               list every signature file and track with this md5
+python signatureindex.py shared [--min N]         list pairs of albums that share at least N tracks
+python signatureindex.py duplicates               list albums whose signature sets are identical
+The index is a sqlite file, see [index] in config.toml
+"""
+import os
+import sqlite3
+import hashlib
+import argparse
+from datetime import datetime
+from pathlib import Path
+from filefolder_org import load_config, fix_directory_name
+from losslessfiles import ffp
+
+config_file = os.path.join(os.path.dirname(__file__),"config.toml")
+config = load_config(config_file)
+IndexDatabase = config.get('index', {}).get('database') or os.path.join(os.path.dirname(__file__), "signature_index.sqlite")
+
+SIGNATURE_EXTENSIONS = ('.ffp', '.st5', '.md5')
+
+
+class signatureindex:
+    """
+    SQLite index of signature files and their (track, md5) entries.
+    Files are re-parsed only when their size or mtime changed since they were indexed. Each file also stores a digest of its sorted md5s so identical albums can be found with one query.
+    """
+    def __init__ (self, dbpath: str = None):
+        self.dbpath = dbpath if dbpath else IndexDatabase
+        self.conn = sqlite3.connect(self.dbpath)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sigfiles (
+                id INTEGER PRIMARY KEY,
+                path TEXT UNIQUE NOT NULL,
+                location TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                tracks INTEGER NOT NULL,
+                setdigest TEXT NOT NULL,
+                indexed TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS signatures (
+                sigfile INTEGER NOT NULL REFERENCES sigfiles(id),
+                track TEXT NOT NULL,
+                md5 TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS signatures_md5 ON signatures(md5);
+            CREATE INDEX IF NOT EXISTS signatures_sigfile ON signatures(sigfile);
+            CREATE INDEX IF NOT EXISTS sigfiles_setdigest ON sigfiles(setdigest);
+            """)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def refresh(self, DirectoryName: str, commit_every: int = 500):
+        """index new and changed signature files under DirectoryName and remove the entries of files that no longer exist there. returns (added/updated, removed, unchanged)"""
+        DirectoryName = Path(os.path.abspath(DirectoryName)).as_posix()
+        known = {path: (sigid, size, mtime_ns) for (sigid, path, size, mtime_ns) in
+                 self.conn.execute("SELECT id, path, size, mtime_ns FROM sigfiles WHERE path LIKE ? ESCAPE '\\'",
+                                   (DirectoryName.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '/%',))}
+        seen = set()
+        updated = unchanged = 0
+        for path, directories, files in os.walk(DirectoryName):
+            for file in files:
+                if not file.lower().endswith(SIGNATURE_EXTENSIONS):
+                    continue
+                sigpath = Path(path).as_posix() + '/' + file
+                seen.add(sigpath)
+                try:
+                    st = os.stat(sigpath)
+                except OSError:
+                    continue
+                previous = known.get(sigpath)
+                if previous is not None and previous[1:] == (st.st_size, st.st_mtime_ns):
+                    unchanged += 1
+                    continue
+                self._index_file(Path(path).as_posix(), file, st, previous[0] if previous else None)
+                updated += 1
+                if updated % commit_every == 0:
+                    self.conn.commit()
+        removed = [sigid for (path, (sigid, size, mtime_ns)) in known.items() if path not in seen]
+        for sigid in removed:
+            self._remove(sigid)
+        self.conn.commit()
+        return updated, len(removed), unchanged
+
+    def _index_file(self, location: str, name: str, st: os.stat_result, sigid: int = None):
+        sigfile = ffp(location, name, {})
+        sigfile.readffpfile()
+        for Err in sigfile.errors:
+            print(Err)
+        entries = [(track, str(md5).strip().lower()) for (track, md5) in sigfile.signatures.items()]
+        setdigest = hashlib.md5('\n'.join(sorted(md5 for (track, md5) in entries)).encode('ascii', 'replace')).hexdigest()
+        if sigid is not None:
+            self._remove(sigid)
+        cursor = self.conn.execute("INSERT INTO sigfiles (path, location, kind, size, mtime_ns, tracks, setdigest, indexed) VALUES (?,?,?,?,?,?,?,?)",
+                                   (location + '/' + name, location, os.path.splitext(name)[1].lower().lstrip('.'), st.st_size, st.st_mtime_ns,
+                                    len(entries), setdigest, datetime.now().isoformat(timespec='seconds')))
+        self.conn.executemany("INSERT INTO signatures (sigfile, track, md5) VALUES (?,?,?)",
+                              [(cursor.lastrowid, track, md5) for (track, md5) in entries])
+
+    def _remove(self, sigid: int):
+        self.conn.execute("DELETE FROM signatures WHERE sigfile = ?", (sigid,))
+        self.conn.execute("DELETE FROM sigfiles WHERE id = ?", (sigid,))
+
+    def find(self, md5: str):
+        """return [(signature file, track)] for every entry with this md5"""
+        return self.conn.execute("""SELECT f.path, s.track FROM signatures s JOIN sigfiles f ON f.id = s.sigfile
+                                    WHERE s.md5 = ? ORDER BY f.path, s.track""", (md5.strip().lower(),)).fetchall()
+
+    def shared_albums(self, min_shared: int = 1):
+        """return [(signature file, signature file, shared track count)] for pairs of different folders that have tracks in common"""
+        return self.conn.execute("""SELECT a.path, b.path, COUNT(DISTINCT sa.md5) AS shared
+                                    FROM signatures sa
+                                    JOIN signatures sb ON sb.md5 = sa.md5 AND sb.sigfile > sa.sigfile
+                                    JOIN sigfiles a ON a.id = sa.sigfile
+                                    JOIN sigfiles b ON b.id = sb.sigfile
+                                    WHERE a.location != b.location
+                                    GROUP BY sa.sigfile, sb.sigfile
+                                    HAVING shared >= ?
+                                    ORDER BY shared DESC, a.path, b.path""", (min_shared,)).fetchall()
+
+    def duplicate_albums(self):
+        """return lists of signature files in different folders whose sets of md5s are identical"""
+        groups = {}
+        for (setdigest, path, location) in self.conn.execute("""SELECT setdigest, path, location FROM sigfiles
+                                                                WHERE tracks > 0 AND setdigest IN
+                                                                    (SELECT setdigest FROM sigfiles WHERE tracks > 0 GROUP BY setdigest HAVING COUNT(DISTINCT location) > 1)
+                                                                ORDER BY setdigest, path"""):
+            groups.setdefault(setdigest, []).append(path)
+        return list(groups.values())
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Index the signatures in all .ffp, .st5 and .md5 files and look tracks up in it')
+    parser.add_argument('--database', help='index file, defaults to [index] database in config.toml')
+    commands = parser.add_subparsers(dest='command', required=True)
+    refresh = commands.add_parser('refresh', help='add new or changed signature files under a directory and drop deleted ones')
+    refresh.add_argument('directory')
+    find = commands.add_parser('find', help='find every track with an md5')
+    find.add_argument('md5')
+    shared = commands.add_parser('shared', help='list albums that share tracks')
+    shared.add_argument('--min', type=int, default=1, help='minimum number of shared tracks')
+    commands.add_parser('duplicates', help='list albums with identical signatures')
+    args = parser.parse_args(argv)
+
+    index = signatureindex(args.database)
+    try:
+        if args.command == 'refresh':
+            updated, removed, unchanged = index.refresh(fix_directory_name(args.directory))
+            print(f'{updated} signature files indexed, {removed} removed, {unchanged} unchanged')
+        elif args.command == 'find':
+            matches = index.find(args.md5)
+            for (path, track) in matches:
+                print(f'{path}: {track}')
+            if not matches:
+                print(f'{args.md5} not found')
+        elif args.command == 'shared':
+            for (a, b, count) in index.shared_albums(args.min):
+                print(f'{count} shared: {a} | {b}')
+        elif args.command == 'duplicates':
+            for group in index.duplicate_albums():
+                print('Duplicates:')
+                for path in group:
+                    print('\t' + path)
+    finally:
+        index.close()
+
+if __name__ == "__main__":
+    main()
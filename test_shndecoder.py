@@ -0,0 +1,26 @@
+"""Decodes the reference .shn files in testdata/shn with shndecoder and checks the MD5 of the audio against reference.st5,
+which holds the MD5s of an independent decoder's output (see testdata/shn/make_vectors.py). Run with python -m pytest test_shndecoder.py"""
+import os
+import pytest
+np = pytest.importorskip("numpy")
+from signaturefiles import read_signature_records
+from losslessfiles import wav_data_md5
+from shndecoder import shnstream
+
+VECTOR_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "testdata", "shn")
+REFERENCE = read_signature_records(os.path.join(VECTOR_DIRECTORY, "reference.st5"), 'st5')
+
+
+@pytest.mark.parametrize("name,md5", REFERENCE, ids=[name for (name, md5) in REFERENCE])
+def test_audio_matches_reference(name, md5):
+    with shnstream(os.path.join(VECTOR_DIRECTORY, name)) as f:
+        assert wav_data_md5(f) == md5
+
+@pytest.mark.parametrize("name", [name for (name, md5) in REFERENCE])
+def test_verbatim_chunks_are_kept(name):
+    """shorten -x writes the stored WAV header (and any trailing chunks) around the samples"""
+    with shnstream(os.path.join(VECTOR_DIRECTORY, name)) as f:
+        data = f.read()
+    assert data[:4] == b'RIFF' and data[8:12] == b'WAVE'
+    if name.startswith('s16'):
+        assert data.endswith(b'LIST\x04\x00\x00\x00abcd')
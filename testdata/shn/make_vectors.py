@@ -0,0 +1,185 @@
+"""This script writes the small .shn reference files used by test_shndecoder.py and their reference.st5
+The files are written by a minimal Shorten encoder below, covering format versions 1-3, running means on and off, every block command
+(DIFF0-3, QLPC, ZERO, BITSHIFT, BLOCKSIZE, VERBATIM) and 8 bit unsigned samples.
+The reference MD5s are not taken from shndecoder: each file is decoded by an independent decoder (ffmpeg's shorten decoder, or shorten -x)
+and the MD5 of its audio is written as a shntool hash -m line, the value the st5 files hold.
+Usage:
+python make_vectors.py <ffmpeg or shorten executable>
+"""
+import os
+import io
+import sys
+import hashlib
+import subprocess
+import numpy as np
+import soundfile as sf
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from shndecoder import *
+from losslessfiles import ST5_LINE, wav_data_md5
+
+VECTOR_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+class bitwriter:
+    """msb first bit writer with the rice codes of the format"""
+    def __init__ (self):
+        self.bits = []
+
+    def put(self, n, value):
+        for i in range(n-1, -1, -1):
+            self.bits.append((value >> i) & 1)
+
+    def uvar(self, k, value):
+        self.bits.extend([0] * (value >> k))
+        self.bits.append(1)
+        self.put(k, value & ((1 << k) - 1))
+
+    def svar(self, k, value):
+        self.uvar(k + 1, (value << 1) if value >= 0 else (((~value) << 1) | 1))
+
+    def ulong(self, value):
+        k = value.bit_length()
+        self.uvar(ULONGSIZE, k)
+        self.uvar(k, value)
+
+    def bytes(self):
+        bits = self.bits + [0] * ((-len(self.bits)) % 8)
+        return np.packbits(np.array(bits, dtype=np.uint8)).tobytes()
+
+def rotate_commands(block, channel):
+    return (block + channel) % 4
+
+def every_command(block, channel):
+    return [FN_DIFF0, FN_DIFF1, FN_DIFF2, FN_DIFF3, FN_QLPC, FN_ZERO][block % 6]
+
+def encode(samples, header, trailer = b'', version = 2, ftype = TYPE_S16LH, blocksize = DEFAULT_BLOCK_SIZE, nmean = 4, plan = rotate_commands, maxnlpc = 2):
+    """samples is an int array of shape (frames, channels), header/trailer are stored as verbatim chunks"""
+    channels = samples.shape[1]
+    w = bitwriter()
+    for value in (ftype, channels, blocksize, maxnlpc, nmean, 0):
+        w.ulong(value)
+    w.uvar(FNSIZE, FN_VERBATIM)
+    w.uvar(VERBATIM_CKSIZE_SIZE, len(header))
+    for byte in header:
+        w.uvar(VERBATIM_BYTE_SIZE, byte)
+    nwrap = max(NWRAP, maxnlpc)
+    history = [[0] * nwrap for c in range(channels)]
+    means = [[0x80 if ftype == TYPE_U8 else 0] * max(1, nmean) for c in range(channels)]
+    bitshift = 0
+    current_blocksize = blocksize
+    lpcqoffset = V2LPCQOFFSET if version > 1 else 0
+    for b in range((len(samples) + blocksize - 1) // blocksize):
+        block = samples[b*blocksize:(b+1)*blocksize].astype(np.int64)
+        if len(block) != current_blocksize:
+            current_blocksize = len(block)
+            w.uvar(FNSIZE, FN_BLOCKSIZE)
+            w.ulong(current_blocksize)
+        shift = 1 if (b % 5 == 3 and not (block & 1).any()) else 0
+        if shift != bitshift:
+            bitshift = shift
+            w.uvar(FNSIZE, FN_BITSHIFT)
+            w.uvar(BITSHIFTSIZE, bitshift)
+        for c in range(channels):
+            x = (block[:, c] >> bitshift).tolist()
+            mean = means[c]
+            if nmean == 0:
+                offset = mean[0]
+            else:
+                offset = cdiv((nmean // 2 if version >= 2 else 0) + sum(mean), nmean)
+                if version >= 2 and bitshift:
+                    offset = offset >> (bitshift - 1) >> 1
+            command = plan(b, c)
+            if command == FN_ZERO and any(x):
+                command = FN_DIFF1
+            w.uvar(FNSIZE, command)
+            h = history[c]
+            if command != FN_ZERO:
+                full = h + x
+                def predict(p):
+                    if command == FN_DIFF0:
+                        return offset
+                    if command == FN_DIFF1:
+                        return full[p-1]
+                    if command == FN_DIFF2:
+                        return 2*full[p-1] - full[p-2]
+                    return 3*full[p-1] - 3*full[p-2] + full[p-3]
+                k = 4
+                if command != FN_QLPC:
+                    residuals = [x[i] - predict(len(h) + i) for i in range(len(x))]
+                    k = max(0, int(sum(abs(r) for r in residuals) / len(residuals) + 1).bit_length() - 1)
+                w.uvar(ENERGYSIZE, k)
+                if command == FN_QLPC:
+                    coefs = [40, -9]
+                    w.uvar(LPCQSIZE, len(coefs))
+                    for coef in coefs:
+                        w.svar(LPCQUANT, coef)
+                    for i in range(len(coefs)):
+                        h[len(h) - len(coefs) + i] -= offset
+                    y = h[len(h) - len(coefs):]
+                    for v in x:
+                        t = lpcqoffset + sum(coefs[j] * y[-1-j] for j in range(len(coefs)))
+                        w.svar(k, (v - offset) - (t >> LPCQUANT))
+                        y.append(v - offset)
+                else:
+                    for r in residuals:
+                        w.svar(k, r)
+            if nmean > 0:
+                total = (current_blocksize // 2 if version >= 2 else 0) + sum(x)
+                del mean[0]
+                mean.append(cdiv(total, current_blocksize) if version < 2 else cdiv(total, current_blocksize) << bitshift)
+            history[c] = (h + x)[-nwrap:]
+    if trailer:
+        w.uvar(FNSIZE, FN_VERBATIM)
+        w.uvar(VERBATIM_CKSIZE_SIZE, len(trailer))
+        for byte in trailer:
+            w.uvar(VERBATIM_BYTE_SIZE, byte)
+    w.uvar(FNSIZE, FN_QUIT)
+    return SHORTEN_MAGIC + bytes([version]) + w.bytes()
+
+def wav_bytes(samples, subtype):
+    f = io.BytesIO()
+    sf.write(f, samples, 44100, subtype=subtype, format='WAV')
+    return f.getvalue()
+
+def vectors():
+    """generate (file name, .shn bytes, raw sample format of the audio)"""
+    rng = np.random.default_rng(5)
+    for version in SHORTEN_VERSIONS:
+        for nmean in (0, 4):
+            for plan in (rotate_commands, every_command):
+                t = np.arange(3000)
+                samples = (8000*np.sin(t/20)[:, None]*np.array([1, 0.5]) + rng.integers(-300, 300, (3000, 2))).astype(np.int64)
+                #even samples for a BITSHIFT block, silence for ZERO blocks
+                samples[256*3:256*4] &= ~1
+                samples[256*5:256*6] = 0
+                header = wav_bytes(samples.astype(np.int16), 'PCM_16')[:44]
+                yield (f's16_v{version}_mean{nmean}_{plan.__name__}.shn',
+                       encode(samples, header, b'LIST\x04\x00\x00\x00abcd', version, nmean=nmean, plan=plan), 's16le')
+    samples = rng.integers(0, 256, (1001, 1)).astype(np.int64)
+    header = wav_bytes((samples - 128).astype(np.int16) << 8, 'PCM_U8')[:44]
+    yield ('u8_v2_mono.shn', encode(samples, header, version=2, ftype=TYPE_U8), 'u8')
+
+def reference_md5(executable, filepath, sampleformat):
+    """MD5 of the audio decoded by ffmpeg, or of the WAV data written by shorten -x"""
+    if os.path.splitext(os.path.basename(executable))[0].lower().startswith('shorten'):
+        proc = subprocess.run([executable, '-x', filepath, '-'], capture_output=True, check=True)
+        return wav_data_md5(io.BytesIO(proc.stdout))
+    proc = subprocess.run([executable, '-v', 'error', '-i', filepath, '-f', sampleformat, '-'], capture_output=True, check=True)
+    return hashlib.md5(proc.stdout).hexdigest()
+
+def main(executable):
+    lines = []
+    for (name, data, sampleformat) in vectors():
+        filepath = os.path.join(VECTOR_DIRECTORY, name)
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        lines.append(ST5_LINE.format(md5=reference_md5(executable, filepath, sampleformat), name=name))
+    with open(os.path.join(VECTOR_DIRECTORY, 'reference.st5'), 'w', encoding='utf-8') as f:
+        f.write(''.join(sorted(lines, key=lambda line: line.split()[-1])))
+    print(f'{len(lines)} vectors written to {VECTOR_DIRECTORY}')
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python make_vectors.py <ffmpeg or shorten executable>")
+        sys.exit(1)
+    main(sys.argv[1])
@@ -0,0 +1,78 @@
+"""This module is not intended for execution. It contains a persistent store of verification results so unchanged files that were verified recently can be skipped"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+
+class verifycache:
+    """
+    SQLite backed record of the last verification result for each file.
+    Entries are keyed by path and are only considered current when the size, mtime and inode of the file
+    and the expected checksum are unchanged, the last result passed, and it was verified within reverify_days.
+    """
+    def __init__ (self, dbpath: str, reverify_days: float = 30):
+        self.dbpath = dbpath
+        self.reverify_days = reverify_days
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbpath, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS verified (
+                                path TEXT PRIMARY KEY,
+                                size INTEGER NOT NULL,
+                                mtime_ns INTEGER NOT NULL,
+                                inode INTEGER NOT NULL,
+                                checksum TEXT NOT NULL,
+                                passed INTEGER NOT NULL,
+                                message TEXT,
+                                verified TEXT NOT NULL)""")
+        self.conn.commit()
+
+    @staticmethod
+    def filekey(filepath: str):
+        """normalized path used as the key for a file"""
+        return Path(os.path.abspath(filepath)).as_posix()
+
+    def is_current(self, filepath: str, checksum: str, st: os.stat_result = None):
+        """
+        Return the time of the last verification if the file passed, is unchanged since, and is still within the re-verify age.
+        Otherwise return None, meaning the file needs to be verified again.
+        """
+        try:
+            st = st if st != None else os.stat(filepath)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime_ns, inode, checksum, passed, verified FROM verified WHERE path = ?",
+                                    (self.filekey(filepath),)).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, inode, cached_checksum, passed, verified = row
+        if (size, mtime_ns, inode) != (st.st_size, st.st_mtime_ns, st.st_ino) or not passed:
+            return None
+        if cached_checksum != str(checksum).strip():
+            return None
+        verified = datetime.fromisoformat(verified)
+        if datetime.now() - verified > timedelta(days=self.reverify_days):
+            return None
+        return verified
+
+    def record(self, filepath: str, checksum: str, passed: bool, message: str = None, st: os.stat_result = None):
+        """store the result of a verification. st should be taken before the file was verified"""
+        try:
+            st = st if st != None else os.stat(filepath)
+        except OSError:
+            return
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO verified (path, size, mtime_ns, inode, checksum, passed, message, verified) VALUES (?,?,?,?,?,?,?,?)",
+                              (self.filekey(filepath), st.st_size, st.st_mtime_ns, st.st_ino, str(checksum).strip(),
+                               1 if passed else 0, message, datetime.now().isoformat(timespec='seconds')))
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
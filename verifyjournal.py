@@ -0,0 +1,60 @@
+"""This module is not intended for execution. It contains an append-only journal of verification results so an interrupted run can be resumed"""
+import os
+import json
+from pathlib import Path
+
+
+class verifyjournal:
+    """
+    Journal of completed (ffp, track, result) entries, one JSON object per line.
+    Every entry is flushed as it is written, so after a crash or Ctrl-C the journal holds everything that finished.
+    When resume is True the existing entries are loaded and those tracks are not verified again, otherwise the journal is started over.
+    """
+    def __init__ (self, path: str, resume: bool = False):
+        self.path = path
+        self.entries = {}
+        if resume:
+            self.load()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+        if resume and self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                partial = f.read(1) != b'\n'
+            if partial:
+                #end the partly written line so the next entry starts on its own line
+                self.file.write('\n')
+
+    @staticmethod
+    def ffpkey(ffpfile):
+        return Path(ffpfile.location + '/' + ffpfile.name).as_posix()
+
+    def load(self):
+        """read the entries of a previous session, a partly written last line from an interrupted run is ignored"""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.entries[(entry['ffp'], entry['track'], entry['checksum'])] = (entry['error'], entry['message'])
+        except FileNotFoundError:
+            pass
+
+    def completed(self, ffpfile, filenm: str, checksum: str):
+        """return (Err, message) if the track was verified in a previous session, otherwise None"""
+        return self.entries.get((self.ffpkey(ffpfile), filenm, str(checksum).strip()))
+
+    def record(self, ffpfile, filenm: str, checksum: str, Err: str, message: str):
+        entry = {'ffp': self.ffpkey(ffpfile), 'track': filenm, 'checksum': str(checksum).strip(), 'error': Err, 'message': message}
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self, remove: bool = False):
+        """close the journal, remove it once the run has completed so the next run starts over"""
+        self.file.close()
+        if remove:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass